@@ -0,0 +1,59 @@
+"""Request backlog of 100k messages on a single event.
+Queues the backlog with no consumers waiting, then lets one consumer drain it.
+The list pattern the broker used before (pop(0)/insert(0)) is timed alongside.
+"""
+import time
+from collections import deque
+
+from harness import MessageBroker, report
+
+BACKLOG = 100000
+EVENT = b"bench"
+
+
+def queue_pattern(queue, pop, push_front):
+	"""What dispatch does to the queue for each message while nobody is waiting"""
+	start = time.perf_counter()
+	for i in range(BACKLOG):
+		queue.append(i)
+		push_front(pop())
+	return time.perf_counter() - start
+
+
+def main():
+	items = []
+	report("list pop(0)/insert(0)", BACKLOG, queue_pattern(items, lambda: items.pop(0), lambda m: items.insert(0, m)))
+	items = deque()
+	report("deque popleft/appendleft", BACKLOG, queue_pattern(items, items.popleft, items.appendleft))
+
+	broker = MessageBroker(max_queued=None)  # The whole backlog is kept
+	event = broker.require_event(EVENT)
+	msg = [b"client", b'', b"x" * 64]
+
+	start = time.perf_counter()
+	for _ in range(BACKLOG):
+		broker.dispatch(event, list(msg))
+	report("broker enqueue, no consumers", BACKLOG, time.perf_counter() - start)
+
+	# Frames to an unknown peer are dropped by the ROUTER socket
+	consumer = broker.require_consumer(b"consumer")
+	consumer.events.append(event)
+	start = time.perf_counter()
+	broker.consumer_waiting(consumer)
+	report("broker drain, one consumer", BACKLOG, time.perf_counter() - start)
+	assert not event.requests
+
+	consumers = [broker.require_consumer(i.to_bytes(4, "big")) for i in range(BACKLOG)]
+	group = event.waiting[b"all"]
+	for c in consumers:
+		group.append(c)
+	start = time.perf_counter()
+	for c in consumers:
+		group.remove(c)
+	report("waiting group remove", BACKLOG, time.perf_counter() - start, "op")
+
+	broker.ctx.destroy(0)
+
+
+if __name__ == '__main__':
+	main()
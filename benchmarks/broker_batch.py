@@ -0,0 +1,44 @@
+"""Broker throughput, batched drain vs one message per poll.
+A batch_size of 1 is the old mediate loop: poll, read one message, purge, heartbeat.
+"""
+import time
+
+import zmq
+
+from harness import MDP, start_broker, stop_broker, raw_socket, raw_consumer, wait_for, report
+
+MESSAGES = 20000
+EVENT = b"bench"
+
+
+def run(batch_size, port):
+	endpoint = f"tcp://127.0.0.1:{port}"
+	broker, thread = start_broker(f"tcp://*:{port}", batch_size=batch_size)
+	ctx = zmq.Context()
+	consumer = raw_consumer(ctx, endpoint, EVENT)
+	producer = raw_socket(ctx, endpoint)
+	wait_for(lambda: EVENT in broker.Events and broker.Events[EVENT].waiting[b"all"])
+
+	start = time.perf_counter()
+	for i in range(MESSAGES):
+		producer.send_multipart([b'', MDP.P_PRODUCER, EVENT, b'', b"x" * 64])  # No correlation id, no reply
+
+	received = 0
+	while received < MESSAGES:
+		msg = consumer.recv_multipart()
+		if msg[2] == MDP.W_REQUEST:
+			received += 1
+	elapsed = time.perf_counter() - start
+
+	ctx.destroy(0)
+	stop_broker(broker, thread)
+	return elapsed
+
+
+def main():
+	for batch_size, port in ((1, 5601), (10, 5602), (100, 5603), (1000, 5604)):
+		report(f"batch_size={batch_size}", MESSAGES, run(batch_size, port))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,84 @@
+"""Load skew across 8 consumers of one group, per dispatch strategy.
+The broker runs in process with its socket stubbed out, so only the dispatch
+decisions are measured. Consumers have credit 4, two of them are 3x slower.
+Each tick 3 or 4 requests for one of 200 post ids arrive (a few ids are hot), then every
+busy consumer finishes its oldest request with the probability of its speed.
+skew is max/mean requests per consumer, latency the mean ticks from arrival to done
+and locality the share of requests for a post id sent to that id's usual consumer.
+hash holds a request until the post id's owner has credit, so a hot id owned by
+a slow consumer queues behind it.
+"""
+import logging
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+from harness import MessageBroker, MDP
+from Broker.broker import DISPATCH, Request
+
+EVENT = MDP.EVENTS.get_post
+CONSUMERS = 8
+CREDIT = 4
+SPEEDS = [0.2, 0.2] + [0.6] * (CONSUMERS - 2)  # Chance to finish a request per tick
+TICKS = 20000
+ARRIVALS = (3, 4)   # Requests per tick, alternating, capacity is 4
+POSTS = 200
+
+
+def run(strategy):
+	rng = random.Random(1)
+	broker = MessageBroker(dispatch=strategy)
+	sent = []
+	working = defaultdict(deque)  # Arrival tick of each request in flight per consumer
+
+	def send(frames, **kwargs):
+		if frames[3] == MDP.W_REQUEST:
+			sent.append((frames[0], frames[7]))  # Consumer address, post id
+			working[frames[0]].append(int(frames[5]))
+	broker.socket.send_multipart = send
+	event = broker.require_event(EVENT)
+	consumers = []
+	for i in range(CONSUMERS):
+		consumer = broker.require_consumer(bytes([i]) * 5)
+		consumer.group = b"post"
+		consumer.credit = CREDIT
+		consumer.events.append(event)
+		broker.consumer_waiting(consumer)
+		consumers.append(consumer)
+	speed = {consumer.address: s for consumer, s in zip(consumers, SPEEDS)}
+
+	latency = done = 0
+	start = time.perf_counter()
+	for tick in range(TICKS):
+		for _ in range(ARRIVALS[tick % 2]):
+			post_id = str(int(rng.paretovariate(1.2)) % POSTS).encode()
+			# Arrival tick as correlation id, keyed by post id like the web tier's get_post
+			broker.dispatch(event, Request([b"client", str(tick).encode(), b'', post_id], key=post_id))
+		for consumer in consumers:
+			consumer.expiry = float('inf')  # No heartbeats in a simulation
+			if consumer.in_flight and rng.random() < speed[consumer.address]:
+				latency += tick - working[consumer.address].popleft()
+				done += 1
+				broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"1", b'', b'', EVENT])
+	elapsed = time.perf_counter() - start
+	broker.destroy()
+
+	load = Counter(address for address, _ in sent)
+	per_key = defaultdict(Counter)
+	for address, post_id in sent:
+		per_key[post_id][address] += 1
+	local = sum(counts.most_common(1)[0][1] for counts in per_key.values())
+	return [load[consumer.address] for consumer in consumers], latency / done, local / len(sent), len(sent), elapsed
+
+
+def main():
+	logging.basicConfig(level=logging.ERROR)
+	print(f"{'strategy':<20} {'per consumer (2 slow first)':<50} {'skew':>6} {'latency':>8} {'locality':>9} {'dispatch/s':>11}")
+	for name, strategy in DISPATCH.items():
+		load, latency, locality, count, elapsed = run(strategy)
+		mean = sum(load) / len(load)
+		print(f"{name:<20} {str(load):<50} {max(load) / mean:>6.2f} {latency:>8.1f} {locality:>9.2f} {count / elapsed:>11.0f}")
+
+
+if __name__ == '__main__':
+	main()
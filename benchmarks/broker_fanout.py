@@ -0,0 +1,89 @@
+"""Broadcast of small events to 1000 subscribers without a group, like user_updated
+reaching every webservice process.
+PerConsumerBroker is the old send path, send_to_consumer rebuilding the frames for
+every subscriber. MessageBroker builds them once per message and reuses them.
+dispatch only times the broker sending, end to end also has the subscribers receive,
+all of them in this one process, so it is mostly bound by receiving.
+"""
+import logging
+import time
+
+import zmq
+
+from harness import MDP, MessageBroker, start_broker, stop_broker, raw_consumer, raw_socket, wait_for, report
+
+SUBSCRIBERS = 1000
+MESSAGES = 100
+DISPATCHES = 200
+BODY = b"x" * 100
+EVENT = b"bench"
+
+
+class PerConsumerBroker(MessageBroker):
+	def broadcast(self, consumers, command, option, msg):
+		for consumer in consumers:
+			self.send_to_consumer(consumer, command, option, msg)
+
+
+def dispatch_only(broker_class):
+	"""Broker in process, subscribers registered but never connected, ROUTER drops the frames"""
+	broker = broker_class()
+	broker.HEARTBEAT_EXPIRY = 10 ** 7  # Nobody heartbeats, keep them registered
+	event = broker.require_event(EVENT)
+	for i in range(SUBSCRIBERS):
+		consumer = broker.require_consumer(i.to_bytes(5, "big"))
+		consumer.events.append(event)
+		broker.consumer_waiting(consumer)
+
+	start = time.perf_counter()
+	for _ in range(DISPATCHES):
+		broker.dispatch(event, [b"client", b'', b'', BODY])
+	elapsed = time.perf_counter() - start
+	broker.Consumers.clear()  # Nobody to disconnect
+	broker.destroy()
+	return elapsed
+
+
+def end_to_end(broker_class, port):
+	endpoint = f"tcp://127.0.0.1:{port}"
+	broker, thread = start_broker(f"tcp://*:{port}", broker_class=broker_class)
+	broker.HEARTBEAT_EXPIRY = 10 ** 7
+	ctx = zmq.Context()
+	subscribers = [raw_consumer(ctx, endpoint, EVENT) for _ in range(SUBSCRIBERS)]
+	producer = raw_socket(ctx, endpoint)
+	wait_for(lambda: EVENT in broker.Events and len(broker.Events[EVENT].waiting[b"all"]) == SUBSCRIBERS, 30)
+	poller = zmq.Poller()
+	for socket in subscribers:
+		poller.register(socket, zmq.POLLIN)
+
+	start = time.perf_counter()
+	for _ in range(MESSAGES):
+		producer.send_multipart([b'', MDP.P_PRODUCER, EVENT, b'', BODY])
+
+	received = 0
+	while received < MESSAGES * SUBSCRIBERS:
+		for socket, _ in poller.poll(1000):
+			while True:
+				try:
+					msg = socket.recv_multipart(zmq.NOBLOCK)
+				except zmq.Again:
+					break
+				if msg[2] == MDP.W_REQUEST:
+					received += 1
+	elapsed = time.perf_counter() - start
+
+	ctx.destroy(0)
+	stop_broker(broker, thread)
+	return elapsed
+
+
+def main():
+	logging.basicConfig(level=logging.ERROR)
+	for broker_class, port in ((PerConsumerBroker, 5623), (MessageBroker, 5624)):
+		name = broker_class.__name__
+		report(f"{name}, dispatch", DISPATCHES * SUBSCRIBERS, dispatch_only(broker_class))
+		report(f"{name}, end to end", MESSAGES * SUBSCRIBERS, end_to_end(broker_class, port))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,58 @@
+"""purge_consumers cost with 10k registered consumers.
+Compares the expiry ordered purge against the old linear scan of every consumer.
+"""
+import time
+from binascii import hexlify
+
+from harness import MessageBroker, report
+
+CONSUMERS = 10000
+PURGES = 10000
+LINEAR_PURGES = 200  # Keep the linear run well below HEARTBEAT_EXPIRY
+
+
+def linear_purge(broker):
+	"""The old purge_consumers, one time.time() per consumer"""
+	to_delete = []
+	for consumer in broker.Consumers.values():
+		if consumer.expiry < time.time():
+			to_delete.append(consumer)
+
+	for consumer in to_delete:
+		broker.delete_consumer(consumer, True)
+
+
+def main():
+	broker = MessageBroker()
+	for i in range(CONSUMERS):
+		broker.require_consumer(i.to_bytes(5, "big"))
+
+	start = time.perf_counter()
+	for _ in range(LINEAR_PURGES):
+		linear_purge(broker)
+	report("linear scan, nothing expired", LINEAR_PURGES, time.perf_counter() - start, "purge")
+
+	start = time.perf_counter()
+	for _ in range(PURGES):
+		broker.purge_consumers()
+	report("expiry ordered, nothing expired", PURGES, time.perf_counter() - start, "purge")
+
+	# Heartbeat every consumer once, newest first, then expire the first 1%
+	start = time.perf_counter()
+	for i in reversed(range(CONSUMERS)):
+		broker.refresh_consumer(broker.Consumers[hexlify(i.to_bytes(5, "big"))])
+	report("refresh", CONSUMERS, time.perf_counter() - start, "refresh")
+
+	for consumer in list(broker.Consumers.values())[:CONSUMERS // 100]:
+		consumer.expiry = 0
+	start = time.perf_counter()
+	broker.purge_consumers()
+	elapsed = time.perf_counter() - start
+	report(f"expiry ordered, {CONSUMERS // 100} expired", 1, elapsed, "purge")
+	assert len(broker.Consumers) == CONSUMERS - CONSUMERS // 100
+
+	broker.destroy()
+
+
+if __name__ == '__main__':
+	main()
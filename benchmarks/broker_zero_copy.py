@@ -0,0 +1,51 @@
+"""Broker forwarding throughput with 1 MB request bodies.
+CopyingBroker turns every received frame into bytes first, like recv_multipart() did.
+"""
+import time
+
+import zmq
+
+from harness import MDP, MessageBroker, start_broker, stop_broker, raw_socket, raw_consumer, wait_for, report
+from common.utils import frame_bytes
+
+MESSAGES = 500
+PAYLOAD = b"x" * (1 << 20)
+EVENT = b"bench"
+
+
+class CopyingBroker(MessageBroker):
+	def process_message(self, msg):
+		super().process_message([frame_bytes(frame) for frame in msg])
+
+
+def run(broker_class, port):
+	endpoint = f"tcp://127.0.0.1:{port}"
+	broker, thread = start_broker(f"tcp://*:{port}", broker_class=broker_class)
+	ctx = zmq.Context()
+	consumer = raw_consumer(ctx, endpoint, EVENT)
+	producer = raw_socket(ctx, endpoint)
+	wait_for(lambda: EVENT in broker.Events and broker.Events[EVENT].waiting[b"all"])
+
+	start = time.perf_counter()
+	for _ in range(MESSAGES):
+		producer.send_multipart([b'', MDP.P_PRODUCER, EVENT, b'', PAYLOAD], copy=False)
+
+	received = 0
+	while received < MESSAGES:
+		msg = consumer.recv_multipart(copy=False)
+		if msg[2].bytes == MDP.W_REQUEST:
+			received += 1
+	elapsed = time.perf_counter() - start
+
+	ctx.destroy(0)
+	stop_broker(broker, thread)
+	return elapsed
+
+
+def main():
+	for broker_class, port in ((CopyingBroker, 5621), (MessageBroker, 5622)):
+		report(f"{broker_class.__name__}, 1 MB bodies", MESSAGES, run(broker_class, port))
+
+
+if __name__ == '__main__':
+	main()
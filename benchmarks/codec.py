@@ -0,0 +1,61 @@
+"""Encode/decode throughput of the message codecs on post payloads.
+legacy is the old str(dict).encode('ascii') and replace("'", '"') + json.loads pair.
+Posts are ASCII without apostrophes so that legacy can decode them at all.
+"""
+import json
+import time
+
+from harness import report
+from common import utils
+
+ROUNDS = 20
+
+
+def make_post(i):
+	"""Same shape as PostService post_to_dict"""
+	return {
+		"id": i,
+		"title": f"title {i}",
+		"date_posted": "Mon, 18 Oct 2026 12:00:00 ",
+		"content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8,
+		"user_id": i % 100,
+		"username": f"user{i % 100}"
+	}
+
+
+def legacy_encode(msg):
+	return str(msg).encode('ascii')
+
+
+def legacy_decode(msg):
+	return json.loads(msg.decode('ascii').replace("'", "\""))
+
+
+def bench(name, payload, encode, decode, rounds):
+	start = time.perf_counter()
+	for _ in range(rounds):
+		data = encode(payload)
+	encoded = time.perf_counter() - start
+
+	start = time.perf_counter()
+	for _ in range(rounds):
+		decode(data)
+	decoded = time.perf_counter() - start
+
+	report(f"{name} encode ({len(data)} B)", rounds, encoded, "op")
+	report(f"{name} decode", rounds, decoded, "op")
+
+
+def main():
+	single = make_post(1)
+	many = [make_post(i) for i in range(10000)]
+
+	for label, payload, rounds in (("1 post", single, 20000), ("10k posts", many, ROUNDS)):
+		print(label)
+		bench("  legacy", payload, legacy_encode, legacy_decode, rounds)
+		for codec in utils.CODECS.values():
+			bench(f"  {codec.__name__}", payload, lambda m: utils.encode_msg(m, codec), utils.msg_to_dict, rounds)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,70 @@
+"""Consumer cold start and failover with an in-process broker.
+Cold start is the time from creating a Consumer until a request to it is answered.
+Failover is the time from restarting the broker until a request is answered again.
+LegacyConsumer adds back the fixed 3 second sleep that reconnect_to_broker used to have.
+"""
+import logging
+import time
+from threading import Thread
+
+from harness import start_broker, stop_broker
+from common.consumerAPI import Consumer
+from common.producerAPI import Producer
+
+EVENT = b"bench"
+
+
+class LegacyConsumer(Consumer):
+	def reconnect_to_broker(self):
+		super().reconnect_to_broker()
+		time.sleep(3)
+
+
+def serve(consumer):
+	while True:
+		req, event = consumer.recv()
+		if event is None:
+			break
+		consumer.reply(req)
+
+
+def answered(producer):
+	"""Requests until the consumer answers, returns when it did"""
+	while producer.request(EVENT, b"ping") != b"ping":
+		pass
+	return time.perf_counter()
+
+
+def run(consumer_class, port):
+	endpoint = f"tcp://127.0.0.1:{port}"
+	broker, thread = start_broker(f"tcp://*:{port}")
+	producer = Producer(endpoint)
+	producer.timeout = 200
+
+	start = time.perf_counter()
+	consumer = consumer_class(endpoint)
+	consumer.subscribe(EVENT)
+	Thread(target=serve, args=(consumer,), daemon=True).start()
+	cold_start = answered(producer) - start
+
+	stop_broker(broker, thread)
+	broker, thread = start_broker(f"tcp://*:{port}")
+	start = time.perf_counter()
+	failover = answered(producer) - start
+
+	stop_broker(broker, thread)
+	consumer.waiting = False
+	producer.destroy()
+	return cold_start, failover
+
+
+def main():
+	# Requests queued while nobody is subscribed are answered late, keep those warnings quiet
+	logging.basicConfig(level=logging.ERROR)
+	for name, consumer_class, port in (("legacy, sleep(3)", LegacyConsumer, 5611), ("handshake", Consumer, 5612)):
+		cold_start, failover = run(consumer_class, port)
+		print(f"{name:<20} cold start {cold_start:6.3f}s  failover {failover:6.3f}s")
+
+
+if __name__ == '__main__':
+	main()
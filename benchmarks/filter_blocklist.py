@@ -0,0 +1,61 @@
+"""Censoring 100 KB posts against a 10k word blocklist.
+naive is the old Filter loop, a substring test and str.replace per banned word.
+blocklist is the compiled trie regex from FilterService.blocklist.
+"""
+import random
+import string
+import time
+
+from harness import report
+from FilterService.blocklist import Blocklist
+
+BLOCKLIST_SIZE = 10000
+POST_SIZE = 100 * 1024
+POSTS = 10
+
+
+def random_word(rng):
+	return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+
+
+def make_post(rng, words, banned):
+	"""Text of random words with roughly one banned word per hundred"""
+	parts = []
+	size = 0
+	while size < POST_SIZE:
+		word = rng.choice(banned) if rng.random() < 0.01 else rng.choice(words)
+		parts.append(word)
+		size += len(word) + 1
+	return " ".join(parts)
+
+
+def naive(words, content):
+	hits = [x for x in words if x in content]
+	for w in hits:
+		content = content.replace(w, "*" * len(w))
+	return content
+
+
+def main():
+	rng = random.Random(13)
+	banned = [random_word(rng) for _ in range(BLOCKLIST_SIZE)]
+	words = [random_word(rng) for _ in range(5000)]
+	posts = [make_post(rng, words, banned) for _ in range(POSTS)]
+
+	start = time.perf_counter()
+	blocklist = Blocklist(banned)
+	report("compile blocklist", 1, time.perf_counter() - start, "op")
+
+	start = time.perf_counter()
+	for post in posts:
+		naive(banned, post)
+	report("naive", POSTS, time.perf_counter() - start, "post")
+
+	start = time.perf_counter()
+	for post in posts:
+		blocklist.censor(post)
+	report("blocklist", POSTS, time.perf_counter() - start, "post")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,86 @@
+"""Filter throughput with 1..cpu_count worker processes in filter_group.
+Every post holds one banned word, so each censored post comes back as one censor_post.
+Worker output is sent to /dev/null, Filter prints every event it handles.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import zmq
+
+from harness import MDP, start_broker, stop_broker, raw_socket, raw_consumer, wait_for, report
+from common import utils
+from FilterService.filter import FilterPool
+
+POSTS = 200
+POST_SIZE = 20 * 1024
+BLOCKLIST_SIZE = 10000
+
+
+def random_word(rng):
+	return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10)))
+
+
+def make_post(i, rng, words, banned):
+	parts = [rng.choice(banned)]
+	size = len(parts[0])
+	while size < POST_SIZE:
+		parts.append(rng.choice(words))
+		size += len(parts[-1]) + 1
+	return {"id": i, "title": f"title {i}", "content": " ".join(parts), "user_id": 1, "username": "user1"}
+
+
+def run(processes, port, banned, posts):
+	endpoint = f"tcp://127.0.0.1:{port}"
+	pool = FilterPool(endpoint, banned, processes)
+	pool.start()  # Fork before the broker thread exists, workers retry until it binds
+	broker, thread = start_broker(f"tcp://*:{port}")
+	ctx = zmq.Context()
+	censored = raw_consumer(ctx, endpoint, MDP.EVENTS.censor_post)
+	producer = raw_socket(ctx, endpoint)
+
+	def ready():
+		event = broker.Events.get(MDP.EVENTS.post_saved)
+		return event is not None and len(event.waiting.get(MDP.GROUP.filter_group, ())) == processes
+	wait_for(ready, timeout=30)
+
+	start = time.perf_counter()
+	for post in posts:
+		producer.send_multipart([b'', MDP.P_PRODUCER, MDP.EVENTS.post_saved, b'', post])
+
+	received = 0
+	while received < len(posts):
+		msg = censored.recv_multipart()
+		if msg[2] == MDP.W_REQUEST:
+			received += 1
+	elapsed = time.perf_counter() - start
+
+	pool.stop()
+	ctx.destroy(0)
+	stop_broker(broker, thread)
+	return elapsed
+
+
+def main():
+	rng = random.Random(14)
+	banned = [random_word(rng) for _ in range(BLOCKLIST_SIZE)]
+	words = [random_word(rng) for _ in range(5000)]
+	posts = [utils.encode_msg(make_post(i, rng, words, banned)) for i in range(POSTS)]
+
+	stdout = sys.stdout
+	cores = multiprocessing.cpu_count()
+	counts = sorted({c for c in (1, 2, 4, 8) if c <= cores} | {cores})
+	for port, processes in enumerate(counts):
+		sys.stdout = open(os.devnull, "w")
+		try:
+			elapsed = run(processes, 5610 + port, banned, posts)
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+		report(f"processes={processes}", POSTS, elapsed, "post")
+
+
+if __name__ == '__main__':
+	main()
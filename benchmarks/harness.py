@@ -0,0 +1,66 @@
+"""Shared helpers for the benchmark scripts.
+Benchmarks are plain scripts, run them from the project root:
+	python benchmarks/<name>.py
+"""
+import os
+import sys
+import time
+from threading import Thread
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from Broker.broker import MessageBroker  # noqa: E402
+from common import MDP  # noqa: E402
+
+
+def start_broker(endpoint, broker_class=MessageBroker, **kwargs):
+	"""Binds a broker to endpoint and runs it in a background thread.
+	High water marks are disabled so no frames are dropped while flooding.
+	"""
+	broker = broker_class(**kwargs)
+	broker.socket.sndhwm = 0
+	broker.socket.rcvhwm = 0
+	broker.bind(endpoint)
+	thread = Thread(target=broker.mediate, daemon=True)
+	thread.start()
+	return broker, thread
+
+
+def stop_broker(broker, thread):
+	broker.mediating = False
+	thread.join()
+	broker.ctx.destroy(0)
+
+
+def raw_socket(ctx, endpoint):
+	"""DEALER socket speaking MDP by hand, without the API classes"""
+	socket = ctx.socket(zmq.DEALER)
+	socket.linger = 0
+	socket.sndhwm = 0
+	socket.rcvhwm = 0
+	socket.connect(endpoint)
+	return socket
+
+
+def raw_consumer(ctx, endpoint, event, group=None):
+	"""Registers a raw consumer socket on event and waits until the broker knows it"""
+	socket = raw_socket(ctx, endpoint)
+	if group is not None:
+		socket.send_multipart([b'', MDP.C_CONSUMER, MDP.W_GROUP, group])
+	socket.send_multipart([b'', MDP.C_CONSUMER, MDP.W_READY, event])
+	return socket
+
+
+def wait_for(predicate, timeout=5.0):
+	"""Spins until predicate() is true"""
+	deadline = time.time() + timeout
+	while not predicate():
+		if time.time() > deadline:
+			raise TimeoutError("condition not met")
+		time.sleep(0.01)
+
+
+def report(name, count, seconds, unit="msg"):
+	print(f"{name:<40} {count:>9} {unit} in {seconds:8.3f}s  {count / seconds:>12.0f} {unit}/s")
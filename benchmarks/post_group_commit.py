@@ -0,0 +1,49 @@
+"""PostService save_post throughput, one commit per save vs group commit.
+Runs the request handlers directly against a SQLite file in a temporary directory,
+the broker is left out so only the database work is measured.
+"""
+import os
+import tempfile
+import time
+
+from harness import MDP, report
+from common import utils
+from PostService import app, db
+from PostService import post_service
+
+SAVES = 2000
+
+
+def save_requests(count):
+	msg = {"title": "title", "content": "Lorem ipsum dolor sit amet. " * 20, "user_id": 1, "username": "user1"}
+	return [(utils.encode_msg(msg), MDP.EVENTS.save_post) for _ in range(count)]
+
+
+def per_request(requests):
+	outbox = []
+	for value, event in requests:
+		post_service.handle(event, value, outbox)
+
+
+def group_commit(requests):
+	outbox = []
+	for i in range(0, len(requests), post_service.GROUP_COMMIT_SIZE):
+		post_service.handle_batch(requests[i:i + post_service.GROUP_COMMIT_SIZE], outbox)
+
+
+def main():
+	with tempfile.TemporaryDirectory() as tmp:
+		app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'posts.db')}"
+		with app.app_context():
+			db.create_all()
+			for name, run in (("commit per save", per_request), (f"group commit of {post_service.GROUP_COMMIT_SIZE}", group_commit)):
+				requests = save_requests(SAVES)
+				start = time.perf_counter()
+				run(requests)
+				report(name, SAVES, time.perf_counter() - start, "save")
+			db.session.remove()
+			db.engine.dispose()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,77 @@
+"""PostService queries on 1M posts without and with the user_id and date_posted indexes.
+The table is first built without indexes, as in a posts.db from before the model
+declared them, then migrate_db adds them in place.
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from harness import report
+from PostService import app, db
+from PostService.model import Post
+from PostService import post_service
+
+ROWS = 1000000
+USERS = 10000
+LOOKUPS = 200
+
+
+def fill(rng):
+	start = datetime(2020, 1, 1)
+	for offset in range(0, ROWS, 50000):
+		rows = [{
+			"title": "title",
+			"content": "content",
+			"date_posted": start + timedelta(seconds=rng.randrange(10 ** 8)),
+			"user_id": rng.randrange(USERS),
+			"username": "user",
+			"image_file": "default.jpg"
+		} for _ in range(offset, min(offset + 50000, ROWS))]
+		db.session.execute(Post.__table__.insert(), rows)
+	db.session.commit()
+
+
+def lookups(rng):
+	start = time.perf_counter()
+	for _ in range(LOOKUPS):
+		post_service.get_posts_by_user(rng.randrange(USERS))
+	report("  get_posts_by_user", LOOKUPS, time.perf_counter() - start, "query")
+
+	start = time.perf_counter()
+	for _ in range(LOOKUPS):
+		post_service.get_posts_page(post_service.PAGE_SIZE)
+	report("  get_posts_page, newest", LOOKUPS, time.perf_counter() - start, "query")
+
+	start = time.perf_counter()
+	for _ in range(LOOKUPS):
+		post_service.get_posts_page(post_service.PAGE_SIZE, rng.randrange(1, ROWS))
+	report("  get_posts_page, cursor", LOOKUPS, time.perf_counter() - start, "query")
+
+
+def main():
+	rng = random.Random(18)
+	with tempfile.TemporaryDirectory() as tmp:
+		app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'posts.db')}"
+		with app.app_context():
+			db.create_all()
+			for index in Post.__table__.indexes:
+				index.drop(bind=db.engine)
+			fill(rng)
+
+			print(f"{ROWS} posts, no indexes")
+			lookups(random.Random(1))
+
+			start = time.perf_counter()
+			post_service.migrate_db()
+			report("migrate_db", 1, time.perf_counter() - start, "op")
+
+			print(f"{ROWS} posts, indexed")
+			lookups(random.Random(1))
+			db.session.remove()
+			db.engine.dispose()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,75 @@
+"""Request throughput of 8 web threads against a service answering after 2 ms.
+shared is the old setup, one Producer for every thread, guarded by a lock since
+ZMQ sockets are not thread safe. pool gives each thread a Producer from ProducerPool.
+"""
+import asyncio
+import logging
+import time
+from threading import Lock, Thread
+
+from harness import start_broker, stop_broker, wait_for, report
+from common.asyncConsumerAPI import AsyncConsumer
+from common.producerAPI import Producer, ProducerPool
+
+EVENT = b"bench"
+THREADS = 8
+REQUESTS = 250          # Per thread
+SERVICE_TIME = 0.002    # Secs
+
+
+class SharedProducer(object):
+	def __init__(self, broker):
+		self.producer = Producer(broker)
+		self.lock = Lock()
+
+	def request(self, service, request):
+		with self.lock:
+			return self.producer.request(service, request)
+
+	def destroy(self):
+		self.producer.destroy()
+
+
+def serve(consumer):
+	@consumer.on(EVENT)
+	async def echo(req):
+		await asyncio.sleep(SERVICE_TIME)
+		return req
+
+	asyncio.run(consumer.run())
+
+
+def run(producer):
+	def client():
+		for i in range(REQUESTS):
+			assert producer.request(EVENT, b"x") == b"x"
+
+	threads = [Thread(target=client) for _ in range(THREADS)]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return time.perf_counter() - start
+
+
+def main():
+	logging.basicConfig(level=logging.ERROR)
+	endpoint = "tcp://127.0.0.1:5620"
+	broker, thread = start_broker("tcp://*:5620")
+	consumer = AsyncConsumer(endpoint, concurrency=THREADS)
+	Thread(target=serve, args=(consumer,), daemon=True).start()
+	wait_for(lambda: EVENT in broker.Events and broker.Events[EVENT].waiting[b"all"])
+
+	for name, producer in (("shared", SharedProducer(endpoint)), ("pool", ProducerPool(endpoint, THREADS))):
+		report(name, THREADS * REQUESTS, run(producer), "req")
+		if isinstance(producer, ProducerPool):
+			print(f"  {producer.metrics()}")
+		producer.destroy()
+
+	consumer.stop()
+	stop_broker(broker, thread)
+
+
+if __name__ == '__main__':
+	main()
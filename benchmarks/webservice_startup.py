@@ -0,0 +1,52 @@
+"""Webservice import and startup time, each run in a fresh interpreter like a new worker.
+import is `import flaskblog`, create_app runs against a site.db that already has its
+schema, as on every start but the first. drop_all + create_all is what init_db used to do.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+RUNS = 5
+
+PROBE = """
+import os, sys, time
+t0 = time.perf_counter()
+import flaskblog
+from flaskblog.config import Config
+t1 = time.perf_counter()
+
+class BenchConfig(Config):
+	SQLALCHEMY_DATABASE_URI = "sqlite:///" + sys.argv[1]
+
+app = flaskblog.create_app(BenchConfig)
+t2 = time.perf_counter()
+with app.app_context():
+	flaskblog.db.drop_all()
+	flaskblog.db.create_all()
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+sys.stdout.flush()
+os._exit(0)  # Skip waiting on the user_updated listener thread
+"""
+
+
+def main():
+	env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (SRC, os.environ.get("PYTHONPATH")) if p))
+	results = []
+	with tempfile.TemporaryDirectory() as tmp:
+		database = os.path.join(tmp, "site.db")
+		for run in range(RUNS + 1):
+			out = subprocess.run([sys.executable, "-c", PROBE, database], env=env, check=True,
+								 stdout=subprocess.PIPE, universal_newlines=True).stdout
+			if run:  # First run creates the schema
+				results.append([float(t) for t in out.split()[-3:]])
+
+	for name, times in zip(("import flaskblog", "create_app", "drop_all + create_all"), zip(*results)):
+		print(f"{name:<40} median {1e3 * statistics.median(times):8.1f} ms  of {RUNS} runs")
+
+
+if __name__ == '__main__':
+	main()
@@ -1,31 +1,186 @@
+import hashlib
 import logging
 import sys
 import time
+import typing
 import zmq
 import random
 
 from binascii import hexlify
-from typing import List, Dict
+from collections import OrderedDict, deque
+from typing import Callable, List, Dict, Deque, Optional, Set, Tuple
 
 # local
 from common import MDP
-from common.utils import dump, bytes_to_command
+from common.utils import dump, bytes_to_command, frame_bytes, setup_logging
+
+
+class RandomDispatch(object):
+	"""Any waiting consumer, picked at random"""
+	def pick(self, group: 'WaitingGroup', msg) -> 'Consumer':
+		return random.choice(group.consumers)
+
+
+class RoundRobinDispatch(object):
+	"""Waiting consumers in turn"""
+	def __init__(self):
+		self.turn = 0
+
+	def pick(self, group: 'WaitingGroup', msg) -> 'Consumer':
+		self.turn += 1
+		return group.consumers[self.turn % len(group.consumers)]
+
+
+class LeastOutstandingDispatch(object):
+	"""The waiting consumer with the fewest requests in flight.
+	Ties are broken in turn, so idle consumers share the load evenly.
+	"""
+	def __init__(self):
+		self.turn = 0
+
+	def pick(self, group: 'WaitingGroup', msg) -> 'Consumer':
+		self.turn += 1
+		consumers = group.consumers
+		n = len(consumers)
+		best = min(range(n), key=lambda i: (consumers[i].in_flight, (i - self.turn) % n))
+		return consumers[best]
+
+
+class ConsistentHashDispatch(object):
+	"""The same key always goes to the same consumer of the group.
+	Rendezvous hashing over every member, waiting or out of credit, each scores
+	hash(address, key) and the highest wins, so a consumer joining or leaving only
+	moves the keys it wins or won. Requests for a busy owner wait for its credit.
+	The key is the dispatch key frame sent with P_KEYED, e.g. the post id,
+	requests without one go to any waiting consumer.
+	"""
+	def pick(self, group: 'WaitingGroup', msg) -> 'Consumer':
+		key = getattr(msg, "key", None)
+		if key is None:
+			return random.choice(group.consumers)
+		return max(group.members, key=lambda consumer: self.score(consumer.address, key))
+
+	@staticmethod
+	def score(address: bytes, key: bytes) -> int:
+		return int.from_bytes(hashlib.blake2b(address + b'\0' + key, digest_size=8).digest(), 'big')
+
+
+# Dispatch strategies by name, as given to --dispatch
+DISPATCH: Dict[str, Callable[[], object]] = {
+	"random": RandomDispatch,
+	"round_robin": RoundRobinDispatch,
+	"least_outstanding": LeastOutstandingDispatch,
+	"hash": ConsistentHashDispatch,
+}
+
+
+class WaitingGroup(object):
+	"""Consumers waiting in one group.
+	A list for random picks plus an index into it, so add, remove and
+	membership are O(1). Removal swaps the last consumer into the hole.
+	strategy picks the consumer a request goes to.
+	members are all consumers of the group, waiting or out of credit.
+	"""
+	consumers: List['Consumer'] = None  	  # Waiting consumers, unordered
+	index: Dict['Consumer', int] = None  	  # Position of each consumer in list
+	members: Set['Consumer'] = None  		  # Every subscribed consumer of the group
+	strategy = None  						  # Dispatch strategy, RandomDispatch by default
+
+	def __init__(self, consumers=(), strategy=None):
+		self.consumers = []
+		self.index = {}
+		self.members = set()
+		self.strategy = strategy if strategy is not None else RandomDispatch()
+		for consumer in consumers:
+			self.append(consumer)
+
+	def append(self, consumer: 'Consumer'):
+		if consumer not in self.index:
+			self.index[consumer] = len(self.consumers)
+			self.consumers.append(consumer)
+
+	def remove(self, consumer: 'Consumer'):
+		"""Removes consumer, raises ValueError like list.remove if missing"""
+		position = self.index.pop(consumer, None)
+		if position is None:
+			raise ValueError(f"{consumer} is not waiting")
+		last = self.consumers.pop()
+		if last is not consumer:
+			self.consumers[position] = last
+			self.index[last] = position
+
+	def pick(self, msg) -> 'Consumer':
+		"""Consumer for request msg, chosen by the group's strategy.
+		It may be a member out of credit, the request then waits for it.
+		"""
+		return self.strategy.pick(self, msg)
+
+	def __contains__(self, consumer):
+		return consumer in self.index
+
+	def __iter__(self):
+		return iter(self.consumers)
+
+	def __len__(self):
+		return len(self.consumers)
+
+	def __repr__(self):
+		return f'{self.consumers}'
+
+
+class Request(list):
+	"""Frames of a queued request that came with a dispatch key"""
+	__slots__ = ("key",)
+
+	def __init__(self, frames, key: bytes):
+		super().__init__(frames)
+		self.key = key
 
 
 class Event(object):
-	"""a single Service"""
+	"""a single Service.
+	Each named group gets one copy of every request and each consumer without a group
+	gets its own. A subscriber that cannot take a request yet keeps it queued, so a
+	busy group never misses requests the others took.
+	Every queue holds at most max_queued requests, beyond that the oldest is dropped.
+	"""
 	name = None  						   		   # Service name
-	requests = None  					   		   # List of client requests
-	waiting: Dict[bytes, List['Consumer']] = None  # List of waiting consumers
-
-	def __init__(self, name):
+	requests: Deque[list] = None  		   		   # Client requests not yet queued for the subscribers
+	waiting: Dict[bytes, WaitingGroup] = None  	   # Waiting consumers per group
+	queues: Dict[bytes, Deque[list]] = None  	   # Requests not yet sent, per named group
+	backlog: Dict['Consumer', Deque[list]] = None  # Requests not yet sent, per consumer without a group
+	held: Dict['Consumer', Deque[list]] = None 	   # Requests picked for a grouped consumer out of credit
+	max_queued = None  							   # Max requests per queue, None is unlimited
+	dropped = 0  								   # Requests dropped from full queues
+
+	def __init__(self, name, max_queued=None):
 		self.name = name
-		self.requests = []
-		self.waiting = {b"all": []}  # Default when no group given
+		self.max_queued = max_queued
+		self.requests = self.new_queue()
+		self.waiting = {b"all": WaitingGroup()}  # Consumers without a group, each gets every request
+		self.queues = {}  	# Dropped with the last consumer of the group
+		self.backlog = {}  	# Dropped with the consumer
+		self.held = {}  	# Back to the group queue when the consumer goes
+		self.dropped = 0
+
+	def new_queue(self) -> Deque[list]:
+		return deque(maxlen=self.max_queued)
+
+	def enqueue(self, queue: Deque[list], msg):
+		"""Appends msg to one of our queues, a full queue drops its oldest request"""
+		if len(queue) == self.max_queued:
+			self.dropped += 1
+			if (self.dropped - 1) % self.max_queued == 0:
+				logging.warning(f"W: queue of {self.name} is full, dropped {self.dropped} requests so far")
+		queue.append(msg)
+
+	def subscribed(self) -> bool:
+		return bool(self.queues or self.backlog)
 
 	def __repr__(self):
 		return f'(Name: {self.name}, nr of reqs: {len(self.requests)}, waiting groups : ' \
-			   f'{[(grp, len(cons)) for (grp, cons) in self.waiting.items()]})'
+			   f'{[(grp, len(cons)) for (grp, cons) in self.waiting.items()]}, queued : ' \
+			   f'{[(grp, len(queue)) for (grp, queue) in self.queues.items()]}, dropped : {self.dropped})'
 
 
 
@@ -36,6 +191,8 @@ class Consumer(object):
 	group = None				# Consumer group
 	events: List[Event] = None  # Events subscribed to by consumer
 	expiry = None  				# expires at this point, unless heartbeat
+	credit = None  				# Max requests in flight, None is unlimited
+	in_flight = 0  				# Requests sent and not yet replied to
 
 	def __init__(self, identity, address, lifetime, group=b"all"):
 		self.identity = identity
@@ -43,16 +200,82 @@ class Consumer(object):
 		self.group = group
 		self.events = []
 		self.expiry = time.time() + 1e-3 * lifetime
+		self.in_flight = 0
+
+	def has_credit(self) -> bool:
+		return self.credit is None or self.in_flight < self.credit
 
 	def __repr__(self):
 		return f'(identity: {self.identity}, address: {self.address}, group: {self.group}, events: {self.events})'
 
 
+class ReplyCache(object):
+	"""LRU cache of consumer replies keyed by (event, request body).
+	Entries expire after ttl seconds. Any event in invalidated_by passing
+	through the broker evicts every cached reply, the ttl bounds how stale a
+	reply cached just before a write can get.
+	Write requests evict it too, not only the events sent once they are committed,
+	so a read right after a write never gets the reply from before it.
+	Replies are encoded with the codec of their request, which the body names,
+	so a request only gets cached replies in its own codec.
+	"""
+	cached = {MDP.EVENTS.get_post, MDP.EVENTS.get_all_post, MDP.EVENTS.get_post_by_user}
+	invalidated_by = {MDP.EVENTS.save_post, MDP.EVENTS.update_post,
+					  MDP.EVENTS.post_saved, MDP.EVENTS.post_updated, MDP.EVENTS.post_deleted,
+					  MDP.EVENTS.censor_post, MDP.EVENTS.user_updated}
+
+	def __init__(self, max_entries=1024, ttl=5.0):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.entries: typing.OrderedDict[tuple, tuple] = OrderedDict()  # (event, body) -> (reply, expiry)
+		self.pending: typing.OrderedDict[tuple, tuple] = OrderedDict()  # (client, correlation) -> (event, body)
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, event, body) -> Optional[bytes]:
+		entry = self.entries.get((event, body))
+		if entry is None or entry[1] < time.time():
+			self.misses += 1
+			return None
+		self.entries.move_to_end((event, body))
+		self.hits += 1
+		return entry[0]
+
+	def expect(self, client, correlation, event, body):
+		"""Remembers which request a reply from a consumer will answer"""
+		self.pending[(client, correlation)] = (event, body)
+		if len(self.pending) > self.max_entries:
+			self.pending.popitem(last=False)  # Never answered
+
+	def put(self, client, correlation, reply):
+		"""Caches reply if it answers a request passed to expect"""
+		key = self.pending.pop((client, correlation), None)
+		if key is None:
+			return
+		self.entries[key] = (reply, time.time() + self.ttl)
+		self.entries.move_to_end(key)
+		if len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+
+	def forget(self, client, correlation):
+		"""The request passed to expect is answered in chunks, which are not cached"""
+		self.pending.pop((client, correlation), None)
+
+	def invalidate(self):
+		self.entries.clear()
+		self.pending.clear()
+
+	def __repr__(self):
+		return f'(entries: {len(self.entries)}, hits: {self.hits}, misses: {self.misses})'
+
+
 class MessageBroker(object):
 	# We'd normally pull these from config data
 	HEARTBEAT_INTERVAL = 2500  			# msecs
 	HEARTBEAT_LIVENESS = 3  			# 3-5 is reasonable
 	HEARTBEAT_EXPIRY = HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS
+	BATCH_SIZE = 100  					# Max messages read per poll
+	MAX_QUEUED = 10000  				# Max requests queued per group or consumer of an event
 
 	# ---------------------------------------------------------------------
 
@@ -62,17 +285,29 @@ class MessageBroker(object):
 
 	heartbeat_at = None       				 # When to send HEARTBEAT
 	Events: Dict[bytes, Event] = None  		 # known Events
-	Consumers: Dict[bytes, Consumer] = None  # known consumers
+	Consumers: typing.OrderedDict[bytes, Consumer] = None  # known consumers, ordered by expiry
 
 	verbose = False
+	batch_size = BATCH_SIZE
+	max_queued = MAX_QUEUED
+	reply_cache: Optional[ReplyCache] = None  # Opt in cache for read replies
+	default_dispatch = RandomDispatch  		  # Strategy of groups without one set
+	dispatch_strategies: Dict[Tuple[bytes, bytes], Callable[[], object]] = None  # Per (event, group)
 
 	# ---------------------------------------------------------------------
 
-	def __init__(self, verbose=False):
-		"""Initialize broker state."""
+	def __init__(self, verbose=False, batch_size=BATCH_SIZE, reply_cache=None, dispatch=None, max_queued=MAX_QUEUED):
+		"""Initialize broker state.
+		dispatch is the default strategy class, e.g. RoundRobinDispatch.
+		"""
 		self.verbose = verbose
+		self.batch_size = batch_size
+		self.max_queued = max_queued
+		self.reply_cache = reply_cache
+		self.default_dispatch = dispatch if dispatch is not None else RandomDispatch
+		self.dispatch_strategies = {}
 		self.Events = {}
-		self.Consumers = {}
+		self.Consumers = OrderedDict()
 		self.heartbeat_at = time.time() + 1e-3 * self.HEARTBEAT_INTERVAL
 		self.ctx = zmq.Context()
 		self.socket = self.ctx.socket(zmq.ROUTER)
@@ -80,14 +315,14 @@ class MessageBroker(object):
 		self.poller = zmq.Poller()
 		self.poller.register(self.socket, zmq.POLLIN)
 		self.mediating = True  # To be able to stop the "event loop"
-		logging.basicConfig(format="%(asctime)s %(message)s",
-							datefmt="%Y-%m-%d %H:%M:%S",
-							level=logging.INFO)
 
 	# ---------------------------------------------------------------------
 
 	def mediate(self, ):
-		"""Main broker work happens here"""
+		"""Main broker work happens here.
+		Every message already queued on the socket is handled, up to batch_size,
+		before purging and heartbeating, so housekeeping runs once per batch.
+		"""
 		while self.mediating:
 			try:
 				items = self.poller.poll(self.HEARTBEAT_INTERVAL)
@@ -95,26 +330,43 @@ class MessageBroker(object):
 				break  # Interrupted
 
 			if items:
-				msg = self.socket.recv_multipart()
-				# if self.verbose:
-				# 	logging.info("I: received message:")
-				# 	dump(msg)
-
-				sender = msg.pop(0)  	  # Frame 0 - Client/consumer peer identity added by ROUTER socket
-				assert b'' == msg.pop(0)  # Frame 1 - empty frame
-				header = msg.pop(0)  	  # Frame 2 - header
-
-				if MDP.P_PRODUCER == header:
-					self.process_producer(sender, msg)
-				elif MDP.C_CONSUMER == header:
-					self.process_consumer(sender, msg)
-				else:
-					logging.error("E: invalid message:")
-					dump(msg)
+				for _ in range(self.batch_size):
+					try:
+						msg = self.socket.recv_multipart(zmq.NOBLOCK, copy=False)
+					except zmq.Again:
+						break  # Socket drained
+					self.process_message(msg)
 
 			self.purge_consumers()
 			self.send_heartbeats()
 
+	def process_message(self, msg):
+		"""Routes a single message received on the socket.
+		Only routing frames are read as bytes, bodies stay zmq.Frame and
+		are forwarded without being copied.
+		"""
+		# if self.verbose:
+		# 	logging.info("I: received message:")
+		# 	dump(msg)
+
+		sender = frame_bytes(msg[0])  # Frame 0 - Client/consumer peer identity added by ROUTER socket
+		assert len(msg[1]) == 0  	  # Frame 1 - empty frame
+		header = frame_bytes(msg[2])  # Frame 2 - header
+		msg = msg[3:]
+
+		if MDP.P_PRODUCER == header:
+			self.process_producer(sender, msg)
+		elif MDP.P_KEYED == header:
+			key = frame_bytes(msg.pop(2))  # Frame 5 - dispatch key, only for the broker
+			self.process_producer(sender, msg, key)
+		elif MDP.P_BATCH == header:
+			self.process_batch(sender, msg)
+		elif MDP.C_CONSUMER == header:
+			self.process_consumer(sender, msg)
+		else:
+			logging.error("E: invalid message:")
+			dump(msg)
+
 
 	def destroy(self):
 		"""Disconnect all consumers, destroy context."""
@@ -123,63 +375,116 @@ class MessageBroker(object):
 			self.delete_consumer(list(values)[0], True)
 		self.ctx.destroy(0)
 
-	def process_producer(self, sender, msg):
-		"""Process a request coming from a client."""
-		assert len(msg) >= 2  # event name + body
-		event = msg.pop(0)    # Frame 3 - event name
+	def process_producer(self, sender, msg, key=None):
+		"""Process a request coming from a client.
+		key is the dispatch key of a P_KEYED request, see ConsistentHashDispatch.
+		"""
+		assert len(msg) >= 3  	  # event name + correlation id + body
+		event = frame_bytes(msg[0])  	   # Frame 3 - event name
+		correlation = frame_bytes(msg[1])  # Frame 4 - correlation id
+
+		if self.reply_cache is not None and self.cache_request(sender, event, correlation, msg[2:]):
+			return  # Answered from cache
 
 		# prefix reply with return address to client
-		msg = [sender, b''] + msg
+		msg[:2] = (sender, correlation, b'')
+		if key is not None:
+			msg = Request(msg, key)
 		self.dispatch(self.require_event(event), msg)
 
+	def cache_request(self, sender, event, correlation, body) -> bool:
+		"""Answers a read request from the reply cache if possible.
+		Writes evict the cache, a missed read is remembered so its reply gets cached.
+		"""
+		if event in self.reply_cache.invalidated_by:
+			self.reply_cache.invalidate()
+			return False
+		if event not in self.reply_cache.cached or not correlation or len(body) != 1:
+			return False
+
+		body = frame_bytes(body[0])
+		reply = self.reply_cache.get(event, body)
+		if reply is None:
+			self.reply_cache.expect(sender, correlation, event, body)
+			return False
+		self.socket.send_multipart([sender, b'', MDP.P_PRODUCER, event, correlation, reply])
+		return True
+
+	def process_batch(self, sender, msg):
+		"""Process a batch of requests coming from a client.
+		Every body is queued as its own request, then dispatched in one pass.
+		A batch of writes evicts the reply cache like a single write does.
+		"""
+		assert len(msg) >= 2  # event name + bodies
+		event = self.require_event(frame_bytes(msg.pop(0)))  # Frame 3 - event name
+		if self.reply_cache is not None and event.name in self.reply_cache.invalidated_by:
+			self.reply_cache.invalidate()
+
+		for body in msg:  # Frame 4.. - request bodies
+			event.enqueue(event.requests, [sender, b'', b'', body])
+		if self.verbose:
+			logging.info(f"I: added batch of {len(msg)} requests to service: {event}")
+		self.dispatch(event, None)
+
 	def process_consumer(self, sender, msg):
 		"""Process message sent to us by a consumer."""
 		assert len(msg) >= 1  # At least, command
 
-		command = msg.pop(0)  # Frame 3 - the command
+		command = frame_bytes(msg.pop(0))  # Frame 3 - the command
 
+		known = hexlify(sender) in self.Consumers
 		consumer: Consumer = self.require_consumer(sender)
 
 		if MDP.W_READY == command:
 			if len(msg) >= 1:
-				event = msg.pop(0)  # Frame 4 - event name
+				event = frame_bytes(msg.pop(0))  # Frame 4 - event name
 
 				# Register event
 				consumer.events.append(self.require_event(event))
 				self.consumer_waiting(consumer)
 			else:
-				consumer.expiry = time.time() + 1e-3 * self.HEARTBEAT_EXPIRY
+				self.refresh_consumer(consumer)
+				self.send_to_consumer(consumer, MDP.W_ACK, None, MDP.W_READY)
 
 		elif MDP.W_GROUP == command:
 			assert len(msg) >= 1
-			group = msg.pop(0)
+			group = frame_bytes(msg.pop(0))
 			if self.verbose:
 				logging.info(f"I: consumer register to group: {group}, consumer: {consumer}")
 			# Assumes consumer has no subscriptions yet
 			# If it does then they need to be removed from Service first
 			consumer.group = group
+			self.send_to_consumer(consumer, MDP.W_ACK, None, MDP.W_GROUP)
+
+		elif MDP.W_CREDIT == command:
+			assert len(msg) >= 1
+			credit = int(frame_bytes(msg.pop(0)))  # Frame 4 - credit
+			assert credit > 0
+			if self.verbose:
+				logging.info(f"I: consumer credit: {credit}, consumer: {consumer}")
+			consumer.credit = credit
+			self.consumer_waiting(consumer)
 
-		elif MDP.W_REPLY == command:
-			# Remove & save client return envelope and insert the
-			# protocol header and event name, then rewrap envelope.
-			logging.info(f"I: REPLY: {msg}")
-			client = msg.pop(0) 	# Frame 4 - Producer identity added by ROUTER socket
-			empty = msg.pop(0)  	# Frame 5 - empty frame
-			reply = msg.pop(0)  	# Frame 6 - Reply message to producer
-			event = msg.pop(0)  	# Frame 7 - event
-			logging.info(f"I: consumer: {consumer}")
-			if reply != b'':
-				for e in consumer.events:
-					if e.name == event:
-						msg = [client, b'', MDP.P_PRODUCER, e.name] + [reply]
-						self.socket.send_multipart(msg)
+		elif MDP.W_REPLY == command or MDP.W_PARTIAL == command:
+			if len(msg) >= 5:
+				self.forward_reply(consumer, command, msg)
+			else:
+				logging.error("E: reply without envelope, dropped:")
+				dump(msg)
+			if MDP.W_PARTIAL == command:
+				return  # More chunks follow, the request is still in flight
 
+			consumer.in_flight = max(0, consumer.in_flight - 1)
 			self.consumer_waiting(consumer)
 
 		elif MDP.W_HEARTBEAT == command:
 			if self.verbose:
 				logging.info(f"I: Heartbeat for consumer: {consumer}")
-			consumer.expiry = time.time() + 1e-3 * self.HEARTBEAT_EXPIRY
+			if known:
+				self.refresh_consumer(consumer)
+			else:
+				# Registered with a broker that is gone, make it register again
+				self.delete_consumer(consumer, True)
 
 		elif MDP.W_DISCONNECT == command:
 			self.delete_consumer(consumer, False)
@@ -187,6 +492,31 @@ class MessageBroker(object):
 			logging.error("E: invalid message:")
 			dump(msg)
 
+	def forward_reply(self, consumer: Consumer, command, msg):
+		"""Sends a W_REPLY or W_PARTIAL from consumer on to the producer.
+		A chunk of a streamed reply goes out as P_STREAM, the final reply as P_PRODUCER.
+		"""
+		# Remove & save client return envelope and insert the
+		# protocol header and event name, then rewrap envelope.
+		client, correlation, empty, *reply, event = msg  # Frames 4-8
+		client = frame_bytes(client)  		  # Frame 4 - Producer identity added by ROUTER socket
+		correlation = frame_bytes(correlation)  # Frame 5 - correlation id
+		event = frame_bytes(event)  			  # Frame 8 - event, always last, Frames 7.. reply stay zmq.Frames
+		if self.verbose:
+			logging.info(f"I: REPLY to {client} from consumer: {consumer}")
+		if len(reply) == 1 and not len(reply[0]):
+			return  # Empty reply, the consumer is only done with the request
+
+		header = MDP.P_PRODUCER if MDP.W_REPLY == command else MDP.P_STREAM
+		for e in consumer.events:
+			if e.name == event:
+				self.socket.send_multipart([client, b'', header, e.name, correlation] + reply, copy=False)
+		if self.reply_cache is not None and event in self.reply_cache.cached:
+			if MDP.W_REPLY == command and len(reply) == 1:
+				self.reply_cache.put(client, correlation, frame_bytes(reply[0]))
+			else:
+				self.reply_cache.forget(client, correlation)
+
 	def require_consumer(self, address):
 		"""Finds the consumer (creates if necessary)."""
 		assert (address is not None)
@@ -206,13 +536,23 @@ class MessageBroker(object):
 		assert (name is not None)
 		event = self.Events.get(name)
 		if event is None:
-			event = Event(name)
+			event = Event(name, self.max_queued)
 			self.Events[name] = event
 			if self.verbose:
 				logging.info(f"I: registering new event: {event}")
 
 		return event
 
+	def set_dispatch(self, event: bytes, group: bytes, strategy: Callable[[], object]):
+		"""Picks consumers of group for event with a new instance of strategy"""
+		self.dispatch_strategies[(event, group)] = strategy
+		waiting = self.Events[event].waiting.get(group) if event in self.Events else None
+		if waiting is not None:
+			waiting.strategy = strategy()
+
+	def new_strategy(self, event: bytes, group: bytes):
+		return self.dispatch_strategies.get((event, group), self.default_dispatch)()
+
 	def bind(self, endpoint):
 		"""Bind broker to endpoint, can call this multiple times.
 		We use a single socket for both clients and consumers.
@@ -228,14 +568,24 @@ class MessageBroker(object):
 
 			self.heartbeat_at = time.time() + 1e-3 * self.HEARTBEAT_INTERVAL
 
+	def refresh_consumer(self, consumer: Consumer):
+		"""Pushes back the consumers expiry.
+		Every refresh uses the same lifetime, so moving the consumer to the end
+		keeps Consumers ordered from first to last expiry.
+		"""
+		consumer.expiry = time.time() + 1e-3 * self.HEARTBEAT_EXPIRY
+		self.Consumers.move_to_end(consumer.identity)
+
 	def purge_consumers(self):
 		"""Look for & kills expired consumers.
 		consumers are oldest to most recent, so we stop at the first alive consumer.
 		"""
+		now = time.time()
 		to_delete = []
 		for consumer in self.Consumers.values():
-			if consumer.expiry < time.time():
-				to_delete.append(consumer)
+			if consumer.expiry >= now:
+				break
+			to_delete.append(consumer)
 
 		for consumer in to_delete:
 			self.delete_consumer(consumer, True)
@@ -250,61 +600,123 @@ class MessageBroker(object):
 			logging.info("I: deleting expired consumer: %s \n"
 						 "\tremoving consumer from event: ", consumer)
 		for event in consumer.events:
-			try:
-				event.waiting[consumer.group].remove(consumer)
-			except ValueError as e:
-				logging.warning(f"W: consumer not in event: {event}\n{e} ")
+			event.backlog.pop(consumer, None)
+			group = event.waiting.get(consumer.group)
+			if group is None:
+				logging.warning(f"W: consumer not in event: {event}")
+				continue
+			group.members.discard(consumer)
+			if consumer in group:
+				group.remove(consumer)
+			held = event.held.pop(consumer, None)
+			if not group.members and consumer.group != b"all":
+				# Nobody left to take them, a group that returns starts afresh
+				event.queues.pop(consumer.group, None)
+			elif held:
+				event.queues[consumer.group].extendleft(reversed(held))  # Picked again among the rest
 			if self.verbose:
 				logging.info(f"\t{event}")
 		self.Consumers.pop(consumer.identity)
 
 	def consumer_waiting(self, consumer: Consumer):
-		"""This consumer is now waiting for work."""
+		"""This consumer is now waiting for work, if it has credit left."""
+		self.refresh_consumer(consumer)
 		# Queue to broker and event waiting lists
 		for event in consumer.events:
-			if consumer.group in event.waiting:
-				if consumer not in event.waiting[consumer.group]:
-					event.waiting[consumer.group].append(consumer)
-					if self.verbose:
-						logging.info(f"I: Register consumer to event: {event}, consumer:  {consumer}")
-			else:
-				event.waiting[consumer.group] = [consumer]
+			# Subscribed from now on, whether it has credit or not
+			group = event.waiting.get(consumer.group)
+			if group is None:
+				group = event.waiting[consumer.group] = WaitingGroup((), self.new_strategy(event.name, consumer.group))
+			group.members.add(consumer)
+			if consumer.group == b"all":
+				if consumer not in event.backlog:
+					event.backlog[consumer] = event.new_queue()
+			elif consumer.group not in event.queues:
+				event.queues[consumer.group] = event.new_queue()
+		for event in consumer.events:
+			if not consumer.has_credit():
+				break  # Dispatch to an earlier event used up the credit
+			group = event.waiting[consumer.group]
+			if consumer not in group:
+				group.append(consumer)
 				if self.verbose:
 					logging.info(f"I: Register consumer to event: {event}, consumer:  {consumer}")
 
-			consumer.expiry = time.time() + 1e-3 * self.HEARTBEAT_EXPIRY
 			self.dispatch(event, None)
 
+	def consumer_dispatched(self, consumer: Consumer):
+		"""Counts a request sent to consumer, stops waiting when out of credit."""
+		consumer.in_flight += 1
+		if consumer.has_credit():
+			return
+
+		for event in consumer.events:
+			group = event.waiting.get(consumer.group)
+			if group is not None and consumer in group:
+				group.remove(consumer)
+
 	def dispatch(self, event: Event, msg):
-		"""Dispatch requests to waiting consumers as possible"""
+		"""Dispatch requests to waiting consumers as possible.
+		Requests wait in event.requests until the event has a subscriber, then every
+		named group and every consumer without a group gets its copy queued.
+		Only requests that want no reply wait for a subscriber, a read would be
+		answered long after its producer gave up.
+		"""
 		assert (event is not None)
 
 		if msg is not None:  # Adds message to queue if any
-			event.requests.append(msg)
-			if self.verbose:
-				logging.info(f"I: added request to service: {event}")
-
-		self.purge_consumers()
-		# Looping while there are available consumers in groups and requests queued
-		while range(0, len(event.requests)):
-			msg = event.requests.pop(0)
-			handle = []
-			for grp, consumers in event.waiting.items():
-				if consumers:  # Checks if there is consumers a
-					if grp == "all":
-						for w in consumers:
-							handle.append(w)
-					else:
-						w = random.choice(consumers)
-						handle.append(w)
-
-			if handle:
-				for w in handle:
-					self.send_to_consumer(w, MDP.W_REQUEST, event.name, msg)
+			if event.subscribed() or not len(msg[1]):  # Frame 1 - correlation id
+				event.enqueue(event.requests, msg)
+				if self.verbose:
+					logging.info(f"I: added request to service: {event}")
 			else:
-				event.requests.insert(0, msg)
-				logging.debug("d: Breaking, no consumers")
-				break  # No consumers available on service
+				logging.debug(f"d: No consumers for {event.name}, dropped request awaiting a reply")
+
+		if not event.subscribed():
+			logging.debug("d: No consumers, holding requests")
+			return
+
+		waiting = event.waiting[b"all"]
+		while event.requests:
+			msg = event.requests.popleft()
+			for queue in event.queues.values():
+				event.enqueue(queue, msg)
+			# Broadcast to every consumer without a group that is caught up, the rest queue it
+			broadcast = []
+			for consumer, backlog in event.backlog.items():
+				if not backlog and consumer in waiting:
+					broadcast.append(consumer)
+				else:
+					event.enqueue(backlog, msg)
+			if broadcast:
+				self.broadcast(broadcast, MDP.W_REQUEST, event.name, msg)
+				for w in broadcast:
+					self.consumer_dispatched(w)
+
+		# Requests picked for a consumer while it was out of credit go before new ones
+		for consumer, held in event.held.items():
+			consumers = event.waiting[consumer.group]
+			while held and consumer in consumers:
+				self.send_to_consumer(consumer, MDP.W_REQUEST, event.name, held.popleft())
+				self.consumer_dispatched(consumer)
+
+		# One consumer per named group takes each request, until the group is out of credit
+		for grp, queue in event.queues.items():
+			consumers = event.waiting.get(grp)
+			while queue and consumers:
+				w = consumers.pick(queue[0])
+				if w in consumers:
+					self.send_to_consumer(w, MDP.W_REQUEST, event.name, queue.popleft())
+					self.consumer_dispatched(w)
+				else:
+					if w not in event.held:
+						event.held[w] = event.new_queue()
+					event.enqueue(event.held[w], queue.popleft())
+
+		for consumer, backlog in event.backlog.items():
+			while backlog and consumer in waiting:
+				self.send_to_consumer(consumer, MDP.W_REQUEST, event.name, backlog.popleft())
+				self.consumer_dispatched(consumer)
 
 	def send_to_consumer(self, consumer: Consumer, command, option, msg=None):
 		"""Send message to consumer.
@@ -316,22 +728,53 @@ class MessageBroker(object):
 			msg = [msg]
 
 		# Stack routing and protocol envelopes to start of message and routing envelope
+		frames = [consumer.address, b'', MDP.C_CONSUMER, command]
+		frames.extend(msg)
 		if option is not None:
-			# msg = option if msg is None else msg + [option]
-			msg = msg + [option]
-		msg = [consumer.address, b'', MDP.C_CONSUMER, command] + msg
+			frames.append(option)
 
 		if self.verbose and command != MDP.W_HEARTBEAT:
 			logging.info("I: sending %r to consumer", bytes_to_command(command))
-			logging.info(f"\t{dump(msg)}")
+			logging.info(f"\t{dump(frames)}")
+
+		# Body frames are still the zmq.Frame received from the producer
+		self.socket.send_multipart(frames, copy=False)
+
+	def broadcast(self, consumers: List[Consumer], command, option, msg):
+		"""Send one message to every consumer.
+		The frames after the routing address are built once and reused for each consumer,
+		and sent one by one with a plain int flag, send_multipart redoes its flag and
+		type checks for every frame of every copy.
+		"""
+		frames = [b'', MDP.C_CONSUMER, command]
+		frames.extend(msg)
+		if option is not None:
+			frames.append(option)
+		last = frames.pop()
+
+		if self.verbose:
+			logging.info("I: broadcasting %r to %d consumers", bytes_to_command(command), len(consumers))
+			logging.info(f"\t{dump(frames + [last])}")
 
-		self.socket.send_multipart(msg)
+		send = self.socket.send
+		more = int(zmq.SNDMORE)
+		for consumer in consumers:
+			send(consumer.address, more)
+			for frame in frames:
+				send(frame, more, copy=False)
+			send(last, 0, copy=False)
 
 
 def main():
 	"""create and start new broker"""
+	setup_logging()
 	verbose = '-v' in sys.argv
-	broker = MessageBroker(True)
+	reply_cache = ReplyCache() if '--cache' in sys.argv else None
+	dispatch = None
+	for arg in sys.argv:
+		if arg.startswith('--dispatch='):
+			dispatch = DISPATCH[arg.split('=', 1)[1]]
+	broker = MessageBroker(True, reply_cache=reply_cache, dispatch=dispatch)
 	broker.bind("tcp://*:5555")
 	broker.mediate()
 
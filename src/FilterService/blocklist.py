@@ -0,0 +1,109 @@
+import logging
+import os
+import re
+import time
+from threading import Thread
+from typing import Callable, List, Optional, Tuple, Pattern
+
+
+def trie_regex(words: List[str]) -> str:
+	"""Regex alternation shaped like a trie of words.
+	Words sharing a prefix share one branch, so the regex engine only backtracks
+	into branches that still match instead of retrying every word.
+	"""
+	trie = {}
+	for word in words:
+		node = trie
+		for char in word:
+			node = node.setdefault(char, {})
+		node[""] = {}  # End of word
+
+	def to_regex(node) -> str:
+		end = "" in node
+		branches = [re.escape(char) + to_regex(child) for char, child in sorted(node.items()) if char]
+		if not branches:
+			return ""
+		if len(branches) == 1 and not end:
+			return branches[0]
+		return "(?:" + "|".join(branches) + ")" + ("?" if end else "")
+
+	return to_regex(trie)
+
+
+class Blocklist:
+	"""Banned words compiled once into a single case-insensitive regex.
+	Only whole words match, "spam" is censored in "Spam!" but not in "spammer".
+	"""
+	def __init__(self, words: List[str]):
+		self.words = sorted({w.lower() for w in words if w})
+		self.pattern: Pattern = None
+		if self.words:
+			self.pattern = re.compile(r"(?<!\w)" + trie_regex(self.words) + r"(?!\w)", re.IGNORECASE)
+
+	def censor(self, content: str) -> Tuple[str, int]:
+		"""Replaces every banned word with asterisks in one pass.
+		:returns: censored content and how many words were replaced
+		"""
+		if self.pattern is None:
+			return content, 0
+		return self.pattern.subn(lambda match: "*" * len(match.group()), content)
+
+	def __len__(self):
+		return len(self.words)
+
+
+class BlocklistFile:
+	"""Blocklist kept in a text file, one word per line.
+	A daemon thread polls the file and compiles a new Blocklist whenever it
+	changes, on_change then swaps it in. Censoring never waits on a compile.
+	"""
+	poll_interval = 1.0     # Secs between checks of the file
+
+	def __init__(self, path: str, on_change: Callable[[Blocklist], None]):
+		self.path = path
+		self.on_change = on_change
+		self.signature = None  # (inode, mtime, size) at the last check
+		self.thread: Optional[Thread] = None
+		self.watching = False
+
+	def read(self) -> List[str]:
+		with open(self.path, encoding='utf-8') as f:
+			return [line.strip() for line in f if line.strip()]
+
+	def save(self, words: List[str]):
+		"""Replaces the file atomically, readers see either the old or the new list"""
+		tmp = f"{self.path}.{os.getpid()}.tmp"
+		with open(tmp, "w", encoding='utf-8') as f:
+			f.write("\n".join(words) + "\n")
+		os.replace(tmp, self.path)
+
+	def check(self) -> bool:
+		"""Compiles and hands over the blocklist if the file changed since the last check.
+		save() replaces the file, so a new inode catches a save within the mtime resolution
+		"""
+		try:
+			stat = os.stat(self.path)
+		except FileNotFoundError:
+			return False
+		signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+		if signature == self.signature:
+			return False
+		self.signature = signature
+		self.on_change(Blocklist(self.read()))
+		return True
+
+	def watch(self):
+		while self.watching:
+			try:
+				self.check()
+			except Exception as e:
+				logging.error(f"E: reloading blocklist {self.path} failed: {e}")
+			time.sleep(self.poll_interval)
+
+	def start(self):
+		self.watching = True
+		self.thread = Thread(target=self.watch, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.watching = False
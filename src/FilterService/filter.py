@@ -1,20 +1,56 @@
-from typing import List
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from threading import Thread
+from typing import List, Optional
 
 from common.MDP import EVENTS, GROUP
 from common import utils, producerAPI, consumerAPI
+from FilterService.blocklist import Blocklist, BlocklistFile
 
 
 
 class Filter:
-	def __init__(self, broker: str, words: List[str], verbose=False):
+	def __init__(self, broker: str, words: List[str], verbose=False, blocklist_file: Optional[str] = None):
 		self.nono_words = words
+		self.blocklist = Blocklist(words)
+		self.blocklist_file = None
 		self.broker = broker
 		self.worker = None
 		self.client = None
 		self.verbose = verbose
 
+		if blocklist_file is not None:
+			self.watch_blocklist(blocklist_file)
 		self.setup()
 
+	def watch_blocklist(self, path: str):
+		"""Takes the blocklist from path from now on, words seed the file if it does not exist"""
+		self.blocklist_file = BlocklistFile(path, self.swap_blocklist)
+		try:
+			self.blocklist_file.read()
+		except FileNotFoundError:
+			self.blocklist_file.save(self.nono_words)
+		self.blocklist_file.check()
+		self.blocklist_file.start()
+
+	def swap_blocklist(self, blocklist: Blocklist):
+		"""Replaces the compiled blocklist in one assignment, censoring in progress keeps the old one"""
+		self.blocklist = blocklist
+		self.nono_words = blocklist.words
+
+	def update_blocklist(self, words: List[str]):
+		"""Compiles words off the hot path.
+		With a blocklist file every worker watching it reloads, not just the one that got the event
+		"""
+		if self.blocklist_file is not None:
+			self.blocklist_file.save(words)
+		else:
+			Thread(target=lambda: self.swap_blocklist(Blocklist(words)), daemon=True).start()
+
 	def setup(self):
 		self.worker = consumerAPI.Consumer(self.broker, self.verbose)
 		self.client = producerAPI.Producer(self.broker, self.verbose)
@@ -25,7 +61,7 @@ class Filter:
 		self.worker.subscribe(EVENTS.post_saved)
 		self.worker.subscribe(EVENTS.user_updated)
 		self.worker.subscribe(EVENTS.user_created)
-
+		self.worker.subscribe(EVENTS.update_blocklist)
 
 	def work(self):
 		while True:
@@ -40,23 +76,100 @@ class Filter:
 				self.filter_post_content(post)
 
 			elif event == EVENTS.user_updated:
-				pass
+				self.worker.ready()
 
 			elif event == EVENTS.user_created:
-				pass
+				self.worker.ready()
+
+			elif event == EVENTS.update_blocklist:
+				self.update_blocklist(utils.msg_to_dict(value)["words"])
+				self.worker.ready()
 
 	def filter_post_content(self, post):
-		content = post["content"]
-		words = [x for x in self.nono_words if x in content]
-		for w in words:
-			content = content.replace(w, "*" * len(w))
-		if words:
+		content, hits = self.blocklist.censor(post["content"])  # Reads the current blocklist once
+		if hits:
 			post["content"] = content
-			self.client.send(EVENTS.censor_post, utils.encode_msg(post))
+			self.client.send(EVENTS.censor_post, utils.encode_msg(post), key=str(post["id"]).encode('ascii'))
 
 		self.worker.ready()
 
 
+def run_filter(broker: str, words: List[str], verbose=False, blocklist_file: Optional[str] = None):
+	"""Entry point of one pool process, sockets are created after the fork"""
+	utils.setup_logging()
+	Filter(broker, words, verbose, blocklist_file).work()
+
+
+class FilterPool:
+	"""Runs processes Filter workers in filter_group and restarts any that die.
+	The broker spreads filter_group events across the workers, so censoring
+	scales with cores instead of being capped by one process.
+	update_blocklist reaches only one worker too, so the workers always share a
+	blocklist file, a temporary one unless blocklist_file is given.
+	"""
+	restart_delay = 1.0     # Secs between supervisor checks
+
+	def __init__(self, broker: str, words: List[str], processes=None, verbose=False, blocklist_file: Optional[str] = None):
+		self.broker = broker
+		self.words = words
+		self.temporary_blocklist = blocklist_file is None  # Removed again by stop()
+		if blocklist_file is None:
+			blocklist_file = os.path.join(tempfile.gettempdir(), f"filter-blocklist-{os.getpid()}.txt")
+		self.blocklist_file = blocklist_file  # Shared by every worker so a reload reaches all of them
+		self.processes = processes or multiprocessing.cpu_count()
+		self.verbose = verbose
+		self.workers: List[multiprocessing.Process] = []
+		self.restarts = 0
+
+	def spawn(self) -> multiprocessing.Process:
+		worker = multiprocessing.Process(target=run_filter, args=(self.broker, self.words, self.verbose, self.blocklist_file),
+										 daemon=True)
+		worker.start()
+		return worker
+
+	def seed_blocklist(self):
+		"""Writes words to the blocklist file unless it exists, before any worker races to"""
+		if not os.path.exists(self.blocklist_file):
+			BlocklistFile(self.blocklist_file, None).save(self.words)
+
+	def start(self):
+		self.seed_blocklist()
+		self.workers = [self.spawn() for _ in range(self.processes)]
+
+	def check(self):
+		"""Replaces every worker that has exited"""
+		for i, worker in enumerate(self.workers):
+			if not worker.is_alive():
+				logging.warning(f"W: filter worker {worker.pid} exited with {worker.exitcode}, restarting")
+				self.workers[i] = self.spawn()
+				self.restarts += 1
+
+	def supervise(self):
+		"""Starts the workers and keeps them running until interrupted"""
+		self.start()
+		try:
+			while True:
+				time.sleep(self.restart_delay)
+				self.check()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.stop()
+
+	def stop(self):
+		for worker in self.workers:
+			worker.terminate()
+		for worker in self.workers:
+			worker.join()
+		self.workers = []
+		if self.temporary_blocklist and os.path.exists(self.blocklist_file):
+			os.remove(self.blocklist_file)
+
+
 if __name__ == '__main__':
-	f = Filter("tcp://localhost:5555", ["naughty", "Putin", "spam"])
-	f.work()
+	# filter.py [processes] [blocklist file]
+	utils.setup_logging()
+	processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+	blocklist_file = sys.argv[2] if len(sys.argv) > 2 else None
+	pool = FilterPool("tcp://localhost:5555", ["naughty", "Putin", "spam"], processes, blocklist_file=blocklist_file)
+	pool.supervise()
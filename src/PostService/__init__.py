@@ -1,10 +1,12 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+
+from common.database import Database
 
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///posts.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLITE_PRAGMAS'] = {"mmap_size": 2**30}  # Read heavy, map all of a large posts.db
 # app.config['FLASK_RUN_PORT'] = 5002
 
-db = SQLAlchemy(app)
+db = Database(app)
@@ -5,9 +5,9 @@ from PostService import db
 class Post(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
 	title = db.Column(db.String(100), nullable=False)
-	date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+	date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 	content = db.Column(db.Text, nullable=False)
-	user_id = db.Column(db.Integer, nullable=False)
+	user_id = db.Column(db.Integer, nullable=False, index=True)
 	username = db.Column(db.String(20), nullable=False)
 	image_file = db.Column(db.String(20), nullable=False, default='default.jpg')
 
@@ -1,5 +1,13 @@
-from typing import List, Dict
+from typing import Iterator, List, Dict, Optional, Tuple, Union
+from collections import OrderedDict
+import calendar
+import itertools
+import logging
 import sys
+import time
+import typing
+
+from sqlalchemy import bindparam, or_, update
 
 # Local
 from PostService import app, db
@@ -7,53 +15,126 @@ from PostService.model import Post
 from common.MDP import EVENTS, GROUP
 from common import utils, consumerAPI, producerAPI
 
+PAGE_SIZE = 20      # Posts per get_all_post page when the request has no limit
+GROUP_COMMIT_SIZE = 100     # Max requests per transaction with --group-commit
+GROUP_COMMIT_WINDOW = 5     # Msecs to wait for more requests before committing
+
 
 def main():
+	utils.setup_logging()
 	verbose = '-v' in sys.argv
-	consumer = consumerAPI.Consumer("tcp://localhost:5555", False)
+	group_commit = '--group-commit' in sys.argv
+	credit = GROUP_COMMIT_SIZE if group_commit else consumerAPI.Consumer.credit
+	consumer = consumerAPI.Consumer("tcp://localhost:5555", False, credit=credit)
 	producer = producerAPI.Producer("tcp://localhost:5555", True)
+	migrate_db()
 	register(consumer)
 
 
 	while True:
-		value, event = consumer.recv()
-		print(f"event: {event}, value: {value}")
-		if event == EVENTS.get_all_post:
-			posts = get_all_posts()
-			msg = utils.encode_msg(posts)
-			consumer.reply(msg)
-
-		elif event == EVENTS.get_post:
-			post = get_post(value.decode('utf-8'))
-			msg = utils.encode_msg(post)
-			consumer.reply(msg)
-
-		elif event == EVENTS.save_post:
-			post = save_post(utils.msg_to_dict(value))
-			producer.send(EVENTS.post_saved, utils.encode_msg(post))
-			consumer.ready()
-
-		elif event == EVENTS.update_post:
-			post = update_post(utils.msg_to_dict(value))
-			producer.send(EVENTS.post_updated, utils.encode_msg(post))
-			consumer.ready()
-
-		elif event == EVENTS.post_deleted:
-			delete_post(utils.msg_to_dict(value))
-			consumer.ready()
-
-		elif event == EVENTS.censor_post:
-			update_post(utils.msg_to_dict(value))
-			consumer.ready()
-
-		elif event == EVENTS.get_post_by_user:
-			posts = get_posts_by_user(value.decode('utf-8'))
-			msg = utils.encode_msg(posts)
-			consumer.reply(msg)
-
-		elif event == EVENTS.user_updated:
-			update_user(utils.msg_to_dict(value))
-			consumer.ready()
+		outbox = []
+		if group_commit:
+			batch = consumer.recv_batch(GROUP_COMMIT_SIZE, GROUP_COMMIT_WINDOW)
+			replies = handle_batch(batch, outbox)
+		else:
+			value, event = consumer.recv()
+			replies = [handle(event, value, outbox)]
+
+		# Events caused by writes only go out once the writes are committed
+		for event, msg in outbox:
+			producer.send(event, msg)
+		if group_commit:
+			consumer.reply_batch(replies)
+		elif isinstance(replies[0], Iterator):
+			consumer.reply_stream(replies[0])
+		else:
+			consumer.reply(b"" if replies[0] is None else replies[0])
+
+
+def handle(event: bytes, value: bytes, outbox: list, commit=True) -> Optional[Union[bytes, Iterator[bytes]]]:
+	"""Handles one request.
+	With commit False writes are only flushed, the caller commits them.
+	Replies are encoded with the codec of the request.
+	:returns: reply body, chunks of a streamed reply, or None when the producer expects no reply
+	"""
+	print(f"event: {event}, value: {value}")
+	codec = utils.codec_of(value)
+	if event == EVENTS.get_all_post:
+		query = utils.msg_to_dict(value) if value else None
+		if query is None:
+			return get_all_posts(codec)
+		if query.get("stream"):
+			return stream_posts(query["stream"], query.get("before"), codec)
+		return get_posts_page(query.get("limit", PAGE_SIZE), query.get("before"), codec)
+
+	elif event == EVENTS.get_post:
+		return get_post(utils.msg_to_dict(value), codec)  # An encoded id, or a bare one from older producers
+
+	elif event == EVENTS.save_post:
+		post = save_post(utils.msg_to_dict(value), commit)
+		outbox.append((EVENTS.post_saved, utils.encode_msg(post)))
+
+	elif event == EVENTS.update_post:
+		post = update_post(utils.msg_to_dict(value), commit)
+		outbox.append((EVENTS.post_updated, utils.encode_msg(post)))
+
+	elif event == EVENTS.post_deleted:
+		delete_post(utils.msg_to_dict(value), commit)
+
+	elif event == EVENTS.censor_post:
+		update_post(utils.msg_to_dict(value), commit)
+
+	elif event == EVENTS.get_post_by_user:
+		return get_posts_by_user(utils.msg_to_dict(value), codec)
+
+	elif event == EVENTS.user_updated:
+		update_user(utils.msg_to_dict(value), commit)
+	return None
+
+
+def handle_batch(batch: List[Tuple[bytes, bytes]], outbox: list) -> list:
+	"""Group commit, every write in batch is committed in one transaction.
+	Reads in the batch see the writes before them through the session.
+	Consecutive user_updated requests are applied together.
+	If the commit fails each request is retried in a transaction of its own,
+	a request failing again is rolled back and skipped, the others still commit
+	and get their events sent.
+	:returns: one reply per request, see handle
+	"""
+	try:
+		replies = []
+		i = 0
+		while i < len(batch):
+			value, event = batch[i]
+			if event == EVENTS.user_updated:
+				# Renames arriving back to back become one executemany UPDATE
+				run = list(itertools.takewhile(lambda request: request[1] == EVENTS.user_updated, batch[i:]))
+				print(f"event: {event}, batch of {len(run)}")
+				update_users([utils.msg_to_dict(v) for v, _ in run], commit=False)
+				replies.extend([None] * len(run))
+				i += len(run)
+			else:
+				replies.append(handle(event, value, outbox, commit=False))
+				i += 1
+		db.session.commit()
+		return replies
+	except Exception as e:
+		db.session.rollback()
+		encoded_posts.clear()  # May hold posts from the rolled back transaction
+		logging.error(f"E: group commit of {len(batch)} requests failed, retrying one at a time: {e}")
+
+	outbox.clear()
+	replies = []
+	for value, event in batch:
+		events = []  # Only reach outbox once the request committed
+		try:
+			replies.append(handle(event, value, events))
+			outbox.extend(events)
+		except Exception as e:
+			db.session.rollback()
+			logging.error(f"E: {event} failed, skipped: {e}")
+			replies.append(None)
+	return replies
 
 
 def register(worker):
@@ -70,76 +151,224 @@ def register(worker):
 	worker.subscribe(EVENTS.user_updated)
 
 
-def get_all_posts() -> List[dict]:
-	posts = []
-	for post in Post.query.all():
-		posts.append(post_to_dict(post))
-	return posts
+class EncodedPosts:
+	"""Posts encoded once per codec and kept by (content type, id).
+	Read replies are joined from the cached bytes, only posts missing from the
+	cache are loaded and encoded. Every write to a post discards it in every codec.
+	Writes handled by other PostService replicas on the same posts.db are not
+	seen here, so entries also expire after ttl seconds, which bounds how long
+	a replica serves a post another one changed.
+	"""
+	load_chunk = 500    # Ids per IN (...) when loading missing posts, SQLite allows 999 variables
+
+	def __init__(self, max_entries=100000, ttl=5.0, codec=None):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.codec = codec or utils.default_codec  # When the caller names none
+		self.entries: typing.OrderedDict[Tuple[bytes, int], Tuple[bytes, float]] = OrderedDict()  # (content type, id) -> (encoded post, expiry)
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, query, codec=None) -> List[bytes]:
+		"""Encoded posts matched by query, in the order of query"""
+		return self.get_ids(post_ids(query), codec)
+
+	def get_ids(self, ids: List[int], codec=None) -> List[bytes]:
+		"""Encoded posts by id, in the order of ids, ids of deleted posts are skipped"""
+		codec = codec or self.codec
+		found = {}
+		missing = []
+		now = time.time()
+		for post_id in ids:
+			key = (codec.content_type, post_id)
+			entry = self.entries.get(key)
+			if entry is None or entry[1] < now:
+				missing.append(post_id)
+			else:
+				found[post_id] = entry[0]
+				self.entries.move_to_end(key)
+		self.hits += len(found)
+		self.misses += len(missing)
+
+		for i in range(0, len(missing), self.load_chunk):
+			for post in Post.query.filter(Post.id.in_(missing[i:i + self.load_chunk])):
+				found[post.id] = self.put(post, codec)
+		return [found[post_id] for post_id in ids if post_id in found]
+
+	def put(self, post: Post, codec=None) -> bytes:
+		codec = codec or self.codec
+		part = codec.encode(post_to_dict(post))
+		key = (codec.content_type, post.id)
+		self.entries[key] = (part, time.time() + self.ttl)
+		self.entries.move_to_end(key)
+		if len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+		return part
+
+	def discard(self, post_id: int):
+		for content_type in utils.CODECS:
+			self.entries.pop((content_type, int(post_id)), None)
+
+	def clear(self):
+		self.entries.clear()
+
+	def message(self, part: bytes, codec=None) -> bytes:
+		"""Message of one encoded value, as encode_msg would make it"""
+		return (codec or self.codec).content_type + part
+
+	def message_list(self, parts: List[bytes], codec=None) -> bytes:
+		codec = codec or self.codec
+		return self.message(codec.join_list(parts), codec)
+
+
+encoded_posts = EncodedPosts()
+
+
+def post_ids(query) -> List[int]:
+	"""Ids of the posts matched by query, without loading the posts"""
+	return [post_id for post_id, in query.with_entities(Post.id)]
+
+
+def get_all_posts(codec=None) -> bytes:
+	return encoded_posts.message_list(encoded_posts.get(Post.query.order_by(Post.id), codec), codec)
+
+
+def newest_posts(before: int = None):
+	"""Posts newest first by date_posted, ties broken by id.
+	The cursor before is the id of the last post seen, the posts after it in this order follow
+	"""
+	query = Post.query.order_by(Post.date_posted.desc(), Post.id.desc())
+	if before is not None:
+		posted = db.session.query(Post.date_posted).filter(Post.id == before).scalar()
+		if posted is None:  # Deleted since, ids mostly grow with date_posted
+			return query.filter(Post.id < before)
+		# The <= bound alone lets SQLite walk the date_posted index from the cursor, an OR at the top would not
+		query = query.filter(Post.date_posted <= posted, or_(Post.date_posted < posted, Post.id < before))
+	return query
+
+
+def get_posts_page(limit: int, before: int = None, codec=None) -> bytes:
+	"""One page of posts after the before cursor, see newest_posts.
+	next is the cursor for the following page, None on the last page
+	"""
+	ids = post_ids(newest_posts(before).limit(limit + 1))
+	more = len(ids) > limit
+	ids = ids[:limit]
+	codec = codec or encoded_posts.codec
+	return encoded_posts.message(codec.join_map({
+		"posts": codec.join_list(encoded_posts.get_ids(ids, codec)),
+		"next": codec.encode(ids[-1] if more else None)
+	}), codec)
+
+
+def stream_posts(chunk_size: int, before: int = None, codec=None) -> Iterator[bytes]:
+	"""Every post after the before cursor, newest first, as messages of chunk_size posts.
+	A chunk is only loaded and encoded once the one before it is sent.
+	Yields at least one, possibly empty, chunk so the producer always gets a reply
+	"""
+	while True:
+		ids = post_ids(newest_posts(before).limit(chunk_size + 1))
+		more = len(ids) > chunk_size
+		ids = ids[:chunk_size]
+		yield encoded_posts.message_list(encoded_posts.get_ids(ids, codec), codec)
+		if not more:
+			return
+		before = ids[-1]
 
 
-def get_post(post_id: int) -> dict:
+def get_post(post_id: int, codec=None) -> bytes:
+	"""The post, or None if there is no such post"""
 	print(f"ID: {post_id}")
-	post = Post.query.get(post_id)
-	return post_to_dict(post)
+	parts = encoded_posts.get(Post.query.filter(Post.id == post_id), codec)
+	if not parts:
+		return utils.encode_msg(None, codec or encoded_posts.codec)
+	return encoded_posts.message(parts[0], codec)
 
 
-def save_post(msg: dict):
+def save_post(msg: dict, commit=True):
 	post = Post(
 		title=msg["title"],
 		content=msg["content"],
 		user_id=msg["user_id"],
 		username=msg["username"])
 	db.session.add(post)
-	db.session.commit()
+	finish(commit)
 	return post_to_dict(post)
 
 
 
 
-def get_posts_by_user(user_id: int) -> List[dict]:
-	posts = []
-	for post in Post.query.filter_by(user_id=user_id).all():
-		posts.append(post_to_dict(post))
-	return posts
+def get_posts_by_user(user_id: int, codec=None) -> bytes:
+	return encoded_posts.message_list(encoded_posts.get(Post.query.filter_by(user_id=user_id).order_by(Post.id), codec), codec)
 
 
 
-def update_post(msg: dict) -> dict:
+def update_post(msg: dict, commit=True) -> dict:
 	post = Post.query.get(msg["id"])
 	post.title = msg["title"]
 	post.content = msg["content"]
+	encoded_posts.discard(post.id)
 
-	db.session.commit()
+	finish(commit)
 
 	return post_to_dict(post)
 
 
-def delete_post(msg):
+def delete_post(msg, commit=True):
 	post = Post.query.get(msg["id"])
 
 	db.session.delete(post)
-	db.session.commit()
+	encoded_posts.discard(post.id)
+	finish(commit)
 
 
-def update_user(msg: dict):
-	posts = Post.query.filter_by(user_id=msg["id"]).all()
-	for post in posts:
-		post.username = msg["username"]
+def update_user(msg: dict, commit=True):
+	update_users([msg], commit)
 
-	db.session.commit()
+
+def update_users(msgs: List[dict], commit=True):
+	"""Renames the posts of every user in msgs with one bulk UPDATE per user.
+	Posts are never loaded, only the last rename of a user counts
+	"""
+	usernames = {msg["id"]: msg["username"] for msg in msgs}
+	db.session.flush()
+	db.session.execute(
+		update(Post).where(Post.user_id == bindparam("uid")).values(username=bindparam("uname")),
+		[{"uid": uid, "uname": uname} for uid, uname in usernames.items()])
+	db.session.expire_all()  # Posts already in the session still have the old username
+	encoded_posts.clear()
+	finish(commit)
+
+
+def finish(commit: bool):
+	"""Commits the session, or only flushes it so ids are assigned when a group commit follows"""
+	if commit:
+		db.session.commit()
+	else:
+		db.session.flush()
 
 
-def post_to_dict(post: Post) -> Dict[str, str]:
+def post_to_dict(post: Post) -> Dict[str, Union[str, int]]:
 	return {
 		"id": post.id,
 		"title": post.title,
-		"date_posted": post.date_posted.strftime('%a, %d %b %Y %X %Z'),
+		"date_posted": calendar.timegm(post.date_posted.utctimetuple()),  # Epoch secs, stored as UTC
 		"content": post.content,
 		"user_id": post.user_id,
 		"username": post.username
 	}
 
 
+def migrate_db():
+	"""Brings an existing posts.db up to the model, create_all skips tables that exist.
+	Adds the indexes on user_id and date_posted, safe to run on every start
+	"""
+	with app.app_context():
+		db.create_all()
+		for index in Post.__table__.indexes:
+			index.create(bind=db.engine, checkfirst=True)
+
+
 def init_db():
 	with app.app_context():
 		db.drop_all()
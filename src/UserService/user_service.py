@@ -9,6 +9,7 @@ from common import utils, producerAPI, consumerAPI
 
 
 def main():
+	utils.setup_logging()
 	verbose = '-v' in sys.argv
 	consumer = consumerAPI.Consumer("tcp://localhost:5555", False)
 	producer = producerAPI.Producer("tcp://localhost:5555", False)
@@ -19,7 +20,7 @@ def main():
 		print(f"event: {event}, value: {value}")
 		if event == EVENTS.get_user:
 			posts = get_user(utils.msg_to_dict(value))
-			consumer.reply(utils.encode_msg(posts))
+			consumer.reply(utils.encode_msg(posts, utils.codec_of(value)))  # In the codec of the request
 
 		elif event == EVENTS.update_user:
 			user = update_user(utils.msg_to_dict(value))
@@ -32,7 +33,7 @@ def main():
 			consumer.ready()
 
 		elif event == EVENTS.censor_user:
-			pass
+			consumer.ready()
 
 
 def register(worker):
@@ -75,6 +76,8 @@ def update_user(msg: dict) -> dict:
 	user = User.query.filter_by(id=msg["id"]).first()
 	user.username = msg["username"]
 	user.email = msg["email"]
+	if msg.get("image_file"):
+		user.image_file = msg["image_file"]
 
 	db.session.commit()
 
@@ -1,7 +1,28 @@
 """Majordomo Protocol definitions"""
 #  This is the version of MDP/Client we implement
+#  Frame 3 - Event name
+#  Frame 4 - Correlation id, empty when no reply is wanted
+#  Frame 5 - Request body
+#  Replies to the client carry the event name, the same correlation id and the reply body
 P_PRODUCER = b"MDPC01"
 
+#  Header of a reply chunk to the client with more chunks to follow, frames as a P_PRODUCER reply.
+#  A streamed reply is any number of these and then one P_PRODUCER reply, all with the same correlation id
+P_STREAM = b"MDPS01"
+
+#  Header of a client request with a dispatch key, e.g. a post id, the broker sends
+#  every request with the same key to the same consumer of a group with the hash strategy
+#  Frame 3 - Event name
+#  Frame 4 - Correlation id, empty when no reply is wanted
+#  Frame 5 - Dispatch key, removed by the broker
+#  Frame 6 - Request body
+P_KEYED = b"MDPK01"
+
+#  Header for a batch of client requests to one event, no replies
+#  Frame 3 - Event name
+#  Frame 4.. - One request body per frame
+P_BATCH = b"MDPB01"
+
 #  This is the version of MDP/Worker we implement
 C_CONSUMER = b"MDPW01"
 
@@ -16,15 +37,29 @@ W_READY
 	Frame 4 - Event name
 W_REQUEST
 	Frame 3 - Client address (envelope stack)
-	Frame 4 - Empty frame (envelope delimiter)
-	Frame 5 - Request body
-	Frame 5 - Event name	
+	Frame 4 - Correlation id (envelope stack)
+	Frame 5 - Empty frame (envelope delimiter)
+	Frame 6 - Request body
+	Frame 7 - Event name
 W_REPLY
 	Frame 3 - The command
 	Frame 4 - Client identity added by ROUTER socket
-	Frame 5 - empty frame
-	Frame 6 - Reply message to client
-	Frame 7 - Event name
+	Frame 5 - Correlation id from the request
+	Frame 6 - empty frame
+	Frame 7 - Reply message to client
+	Frame 8 - Event name
+W_PARTIAL, one chunk of a streamed reply, the request stays in flight until its W_REPLY
+	Frames as W_REPLY
+W_CREDIT
+	Frame 3 - The command
+	Frame 4 - Max requests in flight, ascii integer
+W_ACK, broker to consumer after W_READY without event name and after W_GROUP
+	Frame 3 - The command
+	Frame 4 - The command being acknowledged
+
+The broker only sends W_REQUEST to a consumer while it has credit left,
+every W_REPLY returns one credit. Consumers that never send W_CREDIT get
+unlimited credit.
 
 W_HEARTBEAT and W_DISCONNECT has no extra frames"""
 W_READY         =   b"\001"
@@ -33,6 +68,9 @@ W_REPLY         =   b"\003"
 W_HEARTBEAT     =   b"\004"
 W_DISCONNECT    =   b"\005"
 W_GROUP			=   b"\006"
+W_CREDIT		=   b"\007"
+W_ACK			=   b"\010"
+W_PARTIAL		=   b"\011"
 
 
 bytes_commands = {
@@ -40,7 +78,10 @@ bytes_commands = {
 	b'\002': "W_REQUEST",
 	b'\003': "W_REPLY",
 	b'\004': "W_HEARTBEAT",
-	b'\005': "W_DISCONNECT"
+	b'\005': "W_DISCONNECT",
+	b'\007': "W_CREDIT",
+	b'\010': "W_ACK",
+	b'\011': "W_PARTIAL"
 }
 
 
@@ -63,6 +104,8 @@ class EVENTS:
 	get_user = b"get_user"
 	get_post_by_user = b"get_post_by_user"
 
+	update_blocklist = b"update_blocklist"
+
 
 class GROUP:
 	"""Constants for consumer group names"""
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+import zmq
+import zmq.asyncio
+
+# Local
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from common import MDP
+from common.utils import dump, bytes_to_command
+
+
+Handler = Callable[[bytes], Union[Optional[bytes], Awaitable[Optional[bytes]]]]
+
+
+class AsyncConsumer(object):
+    """Consumer running on an asyncio event loop.
+    Handlers are registered per event and run as tasks, at most concurrency at a time.
+    Coroutine handlers run on the loop, plain functions run in the default executor.
+    A handler returns the reply body, or None when the producer expects no reply.
+    """
+    HEARTBEAT_LIVENESS = 5  # 3-5 is reasonable
+    broker = None           # Broker address
+    ctx = None              # ZMQ asyncio context
+    handler = None          # Socket to broker
+    group = None            # Consumer Group this worker belongs to
+    concurrency = 10        # Max requests handled at once, also our credit at the broker
+
+    liveness = 0            # How many heartbeats left before reconnecting
+    reconnect_due = False   # Set by send_heartbeats, run() reconnects between polls
+    heartbeat = 2500        # Heartbeat delay, msecs
+    reconnect = 2500        # Reconnect delay, msecs
+
+    verbose = False         # Print activity to stdout
+
+    def __init__(self, broker, verbose=False, concurrency=concurrency):
+        self.broker = broker
+        self.verbose = verbose
+        self.concurrency = concurrency
+        self.handlers: Dict[bytes, Handler] = {}
+        self.tasks = set()
+        self.slots = None
+        self.ctx = zmq.asyncio.Context.instance()
+        self.running = False
+        self.last_seen = 0
+
+    def subscribe(self, event: bytes, handler: Handler):
+        """Registers handler for event, takes effect on the next connect"""
+        self.handlers[event] = handler
+        if self.handler is not None:
+            self.send_to_broker(MDP.W_READY, event)
+
+    def on(self, event: bytes):
+        """Decorator form of subscribe"""
+        def register(handler: Handler) -> Handler:
+            self.subscribe(event, handler)
+            return handler
+        return register
+
+    def add_to_group(self, group: bytes):
+        self.group = group
+        if self.handler is not None:
+            self.send_to_broker(MDP.W_GROUP, group)
+
+    def reconnect_to_broker(self):
+        """Connect or reconnect to broker"""
+        if self.handler:
+            self.handler.close()
+        self.handler = self.ctx.socket(zmq.DEALER)
+        self.handler.linger = 0
+        self.handler.connect(self.broker)
+        if self.verbose:
+            logging.info(f"I: connecting to broker at {self.broker}...")
+
+        # Register worker, group and credit before any subscription
+        self.send_to_broker(MDP.W_READY)
+        if self.group is not None:
+            self.send_to_broker(MDP.W_GROUP, self.group)
+        self.send_to_broker(MDP.W_CREDIT, str(self.concurrency).encode('ascii'))
+
+        for event in self.handlers:
+            if self.verbose:
+                logging.info(f"I: Subscribing to {event}")
+            self.send_to_broker(MDP.W_READY, event)
+
+        self.liveness = self.HEARTBEAT_LIVENESS
+        self.last_seen = time.time()
+        self.reconnect_due = False
+
+    def send_to_broker(self, command, option=None, msg=None):
+        """Queues message to broker, the socket never blocks a DEALER send"""
+        if msg is None:
+            msg = []
+        elif not isinstance(msg, list):
+            msg = [msg]
+
+        if option:
+            msg = [option] + msg
+
+        # Frame 0 - Empty frame
+        # Frame 1 - header; “MDPW01” (six bytes, representing MDP/Worker v0.1)
+        # Frame 2 - command
+        msg = [b'', MDP.C_CONSUMER, command] + msg
+        if self.verbose and command != MDP.W_HEARTBEAT:
+            logging.info(f"I: sending {bytes_to_command(command)} to broker\n"
+                         f"\t{msg}")
+        self.handler.send_multipart(msg)
+
+    async def run(self):
+        """Receives requests until stop() is called"""
+        self.running = True
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.reconnect_to_broker()
+        heartbeats = asyncio.ensure_future(self.send_heartbeats())
+        try:
+            while self.running:
+                if self.reconnect_due:
+                    self.reconnect_to_broker()  # Never while a poll awaits the old socket
+                if not await self.handler.poll(self.heartbeat):
+                    continue  # Liveness is tracked by send_heartbeats
+                self.process_message(await self.handler.recv_multipart())
+        finally:
+            heartbeats.cancel()
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def stop(self):
+        self.running = False
+
+    def process_message(self, msg):
+        """Handles one message from broker, W_REQUEST starts a handler task"""
+        self.liveness = self.HEARTBEAT_LIVENESS
+        self.last_seen = time.time()
+
+        assert len(msg) >= 3
+        assert b'' == msg.pop(0)            # Frame 0 - empty frame
+        assert MDP.C_CONSUMER == msg.pop(0)   # Frame 1 - header
+        command = msg.pop(0)                # Frame 2 - one byte, representing type of Command
+        if self.verbose:
+            logging.info("I: received %s from broker: ", bytes_to_command(command))
+
+        if command == MDP.W_REQUEST:
+            reply_to = msg.pop(0)           # Frame 3 - Client address (envelope stack)
+            correlation = msg.pop(0)        # Frame 4 - Correlation id (envelope stack)
+            assert b'' == msg.pop(0)        # Frame 5 - Empty frame (envelope delimiter)
+            req = msg.pop(0)                # Frame 6 - Request body
+            event = msg.pop(0)              # Frame 7 - event name
+            task = asyncio.ensure_future(self.handle(reply_to, correlation, req, event))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        elif command in (MDP.W_HEARTBEAT, MDP.W_ACK):
+            pass  # Registration is not waited on, acknowledgements are ignored
+
+        elif command == MDP.W_DISCONNECT:
+            self.reconnect_to_broker()
+
+        else:
+            logging.error("E: invalid input message: ")
+            dump(msg)
+
+    async def handle(self, reply_to, correlation, req, event):
+        """Runs the handler for event and replies, an empty reply just returns our credit"""
+        reply = None
+        handler = self.handlers.get(event)
+        try:
+            async with self.slots:
+                if handler is None:
+                    logging.error(f"E: no handler for event: {event}")
+                elif asyncio.iscoroutinefunction(handler):
+                    reply = await handler(req)
+                else:
+                    reply = await asyncio.get_event_loop().run_in_executor(None, handler, req)
+        except Exception as e:
+            logging.exception(f"E: handler for {event} failed: {e}")
+
+        if reply is None:
+            reply = b""
+        # Frame 3 - Client address, Frame 4 - Correlation id, Frame 5 - Empty, Frame 6 - Reply body
+        self.send_to_broker(MDP.W_REPLY, msg=[reply_to, correlation, b'', reply, event])
+
+    async def send_heartbeats(self):
+        """Heartbeats the broker on a timer, reconnects when the broker goes quiet"""
+        while self.running:
+            await asyncio.sleep(1e-3 * self.heartbeat)
+            self.send_to_broker(MDP.W_HEARTBEAT)
+
+            if time.time() - self.last_seen > 1e-3 * self.heartbeat:
+                self.liveness -= 1
+                if self.verbose:
+                    logging.info(f"I: liveness: {self.liveness}")
+                if self.liveness <= 0 and not self.reconnect_due:
+                    logging.warning("W: disconnected from broker - retrying...")
+                    await asyncio.sleep(1e-3 * self.reconnect)
+                    self.reconnect_due = True
+
+    def destroy(self):
+        """Closes our socket, the context is shared by the whole process"""
+        if self.handler is not None:
+            self.handler.close()
+            self.handler = None
@@ -3,7 +3,7 @@ import time
 import zmq
 
 # Local
-from typing import Tuple, Optional
+from typing import Iterable, Iterator, Tuple, Optional, List, Union
 
 from common import MDP
 from common.utils import dump, bytes_to_command
@@ -17,47 +17,62 @@ class Consumer(object):
     service = []            # Name of service
     current_service = None  # Service to reply to
     group = None            # Consumer Group this worker belongs to
+    credit = 10             # Max requests the broker may have in flight to us
 
     heartbeat_at = 0        # When to send HEARTBEAT (relative to time.time(), so in seconds)
     liveness = 0            # How many attempts left
     heartbeat = 2500        # Heartbeat delay, msecs
-    reconnect = 2500        # Reconnect delay, msecs
+    reconnect = 2500        # Max reconnect delay, msecs
+    handshake = 100         # First wait for the broker to acknowledge us, msecs
 
     # Internal state
     timeout = 1000          # poller timeout
     verbose = False         # Print activity to stdout
     reply_to = None         # Return address
+    correlation = None      # Correlation id of current request
+    batch_envelopes = []    # Return address, correlation id and event per request from recv_batch
 
-    def __init__(self, broker, verbose=False):
+    def __init__(self, broker, verbose=False, credit=credit, ctx=None):
         self.broker = broker
         self.verbose = verbose
-        self.ctx = zmq.Context()
+        self.credit = credit
+        self.service = []
+        self.ctx = ctx if ctx is not None else zmq.Context.instance()
         self.poller = zmq.Poller()
         self.waiting = True
-        logging.basicConfig(format="%(asctime)s %(message)s",
-                            datefmt="%Y-%m-%d %H:%M:%S",
-                            level=logging.INFO)
         self.reconnect_to_broker()
 
 
     def reconnect_to_broker(self):
-        """Connect or reconnect to broker"""
-        if self.handler:
-            self.poller.unregister(self.handler)
-            self.handler.close()
-        self.handler = self.ctx.socket(zmq.DEALER)
-        self.handler.linger = 0
-        self.handler.connect(self.broker)
-        self.poller.register(self.handler, zmq.POLLIN)
-        if self.verbose:
-            logging.info(f"I: connecting to broker at {self.broker}...")
+        """Connect or reconnect to broker.
+        Waits for the broker to acknowledge registration before subscribing,
+        retrying with exponential backoff from handshake up to reconnect msecs.
+        """
+        delay = self.handshake
+        while True:
+            if self.handler:
+                self.poller.unregister(self.handler)
+                self.handler.close()
+            self.handler = self.ctx.socket(zmq.DEALER)
+            self.handler.linger = 0
+            self.handler.connect(self.broker)
+            self.poller.register(self.handler, zmq.POLLIN)
+            if self.verbose:
+                logging.info(f"I: connecting to broker at {self.broker}...")
+
+            # Register worker
+            expected = {MDP.W_READY}
+            self.send_to_broker(MDP.W_READY, None, [])
+            if self.group is not None:
+                expected.add(MDP.W_GROUP)
+                self.send_to_broker(MDP.W_GROUP, self.group)
 
-        # Register worker
-        self.send_to_broker(MDP.W_READY, None, [])
-        if self.group is not None:
-            self.add_to_group(self.group)
+            if self.wait_for_ack(expected, delay):
+                break
+            logging.warning(f"W: no answer from broker in {delay} msecs - retrying...")
+            delay = min(2 * delay, self.reconnect)
 
-        time.sleep(3)
+        self.set_credit(self.credit)
 
         # Register subscriptions
         for service in self.service:
@@ -69,6 +84,20 @@ class Consumer(object):
         self.liveness = self.HEARTBEAT_LIVENESS
         self.heartbeat_at = time.time() + 1e-3 * self.heartbeat
 
+    def wait_for_ack(self, expected, timeout) -> bool:
+        """Waits up to timeout msecs for the broker to acknowledge every command in expected"""
+        expected = set(expected)
+        deadline = time.time() + 1e-3 * timeout
+        while expected:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self.poller.poll(1e3 * remaining):
+                return False
+
+            msg = self.handler.recv_multipart()
+            # Frame 0 - empty, Frame 1 - header, Frame 2 - command, Frame 3 - acknowledged command
+            if len(msg) >= 4 and msg[2] == MDP.W_ACK:
+                expected.discard(msg[3])
+        return True
 
     def send_to_broker(self, command, option=None, msg=None):
         """Send message to broker.
@@ -104,23 +133,47 @@ class Consumer(object):
         self.group = group
         self.send_to_broker(MDP.W_GROUP, group)
 
+    def set_credit(self, credit: int):
+        """Tells the broker how many requests it may send before we reply"""
+        self.credit = credit
+        self.send_to_broker(MDP.W_CREDIT, str(credit).encode('ascii'))
+
     def reply(self, msg: bytes):
         """Format and send reply to client"""
+        self.send_reply(MDP.W_REPLY, msg)
+        self.current_service = None
 
+    def reply_part(self, msg: bytes):
+        """Sends one chunk of a streamed reply, end the stream with reply()"""
+        self.send_reply(MDP.W_PARTIAL, msg)
+
+    def reply_stream(self, chunks: Iterable[bytes]):
+        """Sends every chunk as it is produced, the last one ends the stream.
+        Without any chunk only tells the broker we are done with the request
+        """
+        last = None
+        for chunk in chunks:
+            if last is not None:
+                self.reply_part(last)
+            last = chunk
+        self.reply(b"" if last is None else last)
+
+    def send_reply(self, command, msg):
+        """W_REPLY or W_PARTIAL to the request we are handling"""
         assert self.reply_to is not None
         assert self.current_service is not None
         if msg is None:
             msg = []
         elif not isinstance(msg, list):
             msg = [msg]
-        # Creating W_REPLY message consisting of:
+        # Creating W_REPLY or W_PARTIAL message consisting of:
         # Frame 3 - Client address (envelope stack)
-        # Frame 4 - Empty frame (envelope delimiter)
-        # Frame 5 - Reply body
-        reply = [self.reply_to, b''] + msg + [self.current_service]
+        # Frame 4 - Correlation id (envelope stack)
+        # Frame 5 - Empty frame (envelope delimiter)
+        # Frame 6 - Reply body
+        reply = [self.reply_to, self.correlation, b''] + msg + [self.current_service]
         print(f"Sending reply: {msg}\nto: {self.reply_to}, \nEvent: {self.current_service}\n")
-        self.send_to_broker(MDP.W_REPLY, msg=reply)
-        self.current_service = None
+        self.send_to_broker(command, msg=reply)
 
     def ready(self):
         """Tells the broker we are ready for more work when we dont need to reply"""
@@ -138,34 +191,9 @@ class Consumer(object):
 
 
             if items:
-                msg = self.handler.recv_multipart()
-
-                self.liveness = self.HEARTBEAT_LIVENESS
-
-                assert len(msg) >= 3
-                assert b'' == msg.pop(0)            # Frame 0 - empty frame
-                assert MDP.C_CONSUMER == msg.pop(0)   # Frame 1 - header
-                command = msg.pop(0)                # Frame 2 - one byte, representing type of Command
-                if self.verbose:
-                    logging.info("I: received %s from broker: ", bytes_to_command(command))
-
-                if command == MDP.W_REQUEST:
-                    self.reply_to = msg.pop(0)      # Frame 3 - Client address (envelope stack)
-                    assert b'' == msg.pop(0)        # Frame 4 - Empty frame (envelope delimiter)
-                    req = msg.pop(0)                # Frame 5 - Request body
-                    event = msg.pop(0)              # Frame 6 - event name
-                    self.current_service = event
-                    return req, event
-
-                elif command == MDP.W_HEARTBEAT:
-                    pass  # Do nothing for heartbeats
-
-                elif command == MDP.W_DISCONNECT:
-                    self.reconnect_to_broker()
-
-                else:
-                    logging.error("E: invalid input message: ")
-                    dump(msg)
+                request = self.process_message(self.handler.recv_multipart())
+                if request is not None:
+                    return request
 
             else:
                 self.liveness -= 1
@@ -174,11 +202,9 @@ class Consumer(object):
                 if self.liveness == 0:
                     logging.warning("W: disconnected from broker - retrying...")
                     try:
-                        time.sleep(1e-3*self.reconnect)
+                        self.reconnect_to_broker()
                     except KeyboardInterrupt:
                         break
-                    logging.debug("D: reconnecting to broker...")
-                    self.reconnect_to_broker()
 
             # Send HEARTBEAT if it's time
             if time.time() > self.heartbeat_at:
@@ -188,7 +214,88 @@ class Consumer(object):
         logging.warning("W: interrupt received, killing worker...")
         return (None, None)
 
+    def recv_batch(self, max_batch=None, window=0) -> List[Tuple[bytes, bytes]]:
+        """Waits for next request, then also takes every request already delivered
+        or delivered within window msecs of the first one.
+        Takes at most max_batch requests, defaults to our credit.
+        Acknowledge the whole batch with ready_batch() or reply_batch()
+        """
+        if max_batch is None:
+            max_batch = self.credit
+        req, event = self.recv()
+        if event is None:
+            return []
+        batch = [(req, event)]
+        self.batch_envelopes = [(self.reply_to, self.correlation, event)]
+
+        deadline = time.time() + 1e-3 * window
+        while len(batch) < max_batch:
+            try:
+                msg = self.handler.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                remaining = deadline - time.time()
+                if remaining > 0 and self.handler.poll(1e3 * remaining):
+                    continue
+                break  # Nothing more delivered
+            request = self.process_message(msg)
+            if request is not None:
+                batch.append(request)
+                self.batch_envelopes.append((self.reply_to, self.correlation, self.current_service))
+        return batch
+
+    def ready_batch(self):
+        """Tells the broker we are done with every request from recv_batch"""
+        self.reply_batch([None] * len(self.batch_envelopes))
+
+    def reply_batch(self, replies: List[Optional[Union[bytes, Iterator[bytes]]]]):
+        """Replies to every request from recv_batch in order.
+        A None reply only tells the broker we are done with that request,
+        an iterator of chunks is streamed with reply_stream()
+        """
+        for (reply_to, correlation, event), reply in zip(self.batch_envelopes, replies):
+            self.reply_to = reply_to
+            self.correlation = correlation
+            self.current_service = event
+            if isinstance(reply, Iterator):
+                self.reply_stream(reply)
+            else:
+                self.reply(b"" if reply is None else reply)
+        self.batch_envelopes = []
+
+    def process_message(self, msg) -> Optional[Tuple[bytes, bytes]]:
+        """Handles one message from broker, returns request body and event for W_REQUEST"""
+        self.liveness = self.HEARTBEAT_LIVENESS
+
+        assert len(msg) >= 3
+        assert b'' == msg.pop(0)            # Frame 0 - empty frame
+        assert MDP.C_CONSUMER == msg.pop(0)   # Frame 1 - header
+        command = msg.pop(0)                # Frame 2 - one byte, representing type of Command
+        if self.verbose:
+            logging.info("I: received %s from broker: ", bytes_to_command(command))
+
+        if command == MDP.W_REQUEST:
+            self.reply_to = msg.pop(0)      # Frame 3 - Client address (envelope stack)
+            self.correlation = msg.pop(0)   # Frame 4 - Correlation id (envelope stack)
+            assert b'' == msg.pop(0)        # Frame 5 - Empty frame (envelope delimiter)
+            req = msg.pop(0)                # Frame 6 - Request body
+            event = msg.pop(0)              # Frame 7 - event name
+            self.current_service = event
+            return req, event
+
+        elif command in (MDP.W_HEARTBEAT, MDP.W_ACK):
+            pass  # Do nothing for heartbeats and late acknowledgements
+
+        elif command == MDP.W_DISCONNECT:
+            self.reconnect_to_broker()
+
+        else:
+            logging.error("E: invalid input message: ")
+            dump(msg)
+        return None
 
     def destroy(self):
-        # context.destroy depends on pyzmq >= 2.1.10
-        self.ctx.destroy(0)
+        """Closes our socket, the context is shared or owned by whoever passed it in"""
+        if self.handler is not None:
+            self.poller.unregister(self.handler)
+            self.handler.close()
+            self.handler = None
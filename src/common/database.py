@@ -0,0 +1,54 @@
+from typing import Dict
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+# PRAGMAs run on every new SQLite connection, a service overrides any of them
+# with the SQLITE_PRAGMAS dict in its app.config
+SQLITE_PRAGMAS = {
+	"journal_mode": "WAL",      # Readers do not block behind a writer, nor the writer behind readers
+	"synchronous": "NORMAL",    # fsync at checkpoints instead of every commit, durable enough with WAL
+	"mmap_size": 256 * 2**20,   # Bytes of the database file read through a memory map
+	"cache_size": -64 * 2**10,  # Page cache per connection, negative is KiB
+	"temp_store": "MEMORY",
+	"busy_timeout": 5000,       # Msecs to wait for a lock instead of failing at once
+}
+SQLITE_POOL_SIZE = 5        # Connections kept open, default for SQLITE_POOL_SIZE in app.config
+
+
+def sqlite_pragmas(config) -> Dict[str, object]:
+	"""SQLITE_PRAGMAS with the overrides from config, None drops a PRAGMA"""
+	pragmas = dict(SQLITE_PRAGMAS, **config.get('SQLITE_PRAGMAS', {}))
+	return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def apply_pragmas(connection, pragmas: Dict[str, object]):
+	cursor = connection.cursor()
+	for name, value in pragmas.items():
+		cursor.execute(f"PRAGMA {name}={value}")
+	cursor.close()
+
+
+class Database(SQLAlchemy):
+	"""Flask-SQLAlchemy with tuned, pooled SQLite connections.
+	Flask-SQLAlchemy opens a new connection per session for SQLite files,
+	this keeps SQLITE_POOL_SIZE of them open and runs the PRAGMAs once per connection.
+	Other databases are left as they are.
+	"""
+	def apply_driver_hacks(self, app, sa_url, options):
+		if sa_url.drivername == 'sqlite' and sa_url.database not in (None, '', ':memory:'):
+			options.setdefault('poolclass', QueuePool)
+			options.setdefault('pool_size', app.config.get('SQLITE_POOL_SIZE', SQLITE_POOL_SIZE))
+			options.setdefault('connect_args', {})['check_same_thread'] = False  # Pooled connections change threads
+			options['sqlite_pragmas'] = sqlite_pragmas(app.config)
+		return super().apply_driver_hacks(app, sa_url, options)
+
+	def create_engine(self, sa_url, engine_opts):
+		engine_opts = dict(engine_opts)
+		pragmas = engine_opts.pop('sqlite_pragmas', None)
+		engine = super().create_engine(sa_url, engine_opts)
+		if pragmas:
+			event.listen(engine, "connect", lambda connection, record: apply_pragmas(connection, pragmas))
+		return engine
@@ -4,8 +4,16 @@ Author: Min RK <benjaminrk@gmail.com>
 Based on Java example by Arkadiusz Orzechowski
 """
 
+import itertools
 import logging
+import queue
+import threading
+import time
 import zmq
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Deque, Iterator, List, Dict, Tuple
 
 from common import MDP
 from common.utils import dump
@@ -21,17 +29,18 @@ class Producer(object):
     poller = None
     timeout = 5000  # in milliseconds
     verbose = False
-    expect_reply = False
+    pending: Dict[bytes, Future] = None  # Unresolved request_async futures by correlation id
+    streams: Dict[bytes, Deque[Tuple[bytes, bool]]] = None  # Chunks not yet read per request_stream, with last flag
 
-    def __init__(self, broker, verbose=False):
+    def __init__(self, broker, verbose=False, ctx=None):
+        """Connects on first use, ctx defaults to the process wide zmq.Context.instance()"""
         self.broker = broker
         self.verbose = verbose
-        self.ctx = zmq.Context()
+        self.ctx = ctx if ctx is not None else zmq.Context.instance()
         self.poller = zmq.Poller()
-        logging.basicConfig(format="%(asctime)s %(message)s",
-                            datefmt="%Y-%m-%d %H:%M:%S",
-                            level=logging.INFO)
-        self.reconnect_to_broker()
+        self.pending = {}
+        self.streams = {}
+        self.correlation_ids = itertools.count(1)
 
     def reconnect_to_broker(self):
         """Connect or reconnect to broker"""
@@ -47,53 +56,245 @@ class Producer(object):
             logging.info("I: connecting to broker at %s...", self.broker)
 
     def destroy(self):
-        self.ctx.destroy(0)
+        """Closes our socket, the context is shared or owned by whoever passed it in"""
+        self.close()
 
-    def request(self, service, request) -> bytes:
+    def close(self):
+        """Closes our socket only, for producers sharing a context"""
+        if self.client is not None:
+            self.poller.unregister(self.client)
+            self.client.close()
+            self.client = None
+
+    def request(self, service, request, key=None) -> bytes:
         """Send message to broker and waits for response"""
-        self.send(service, request, response=True)
-        return self.recv()
+        future = self.request_async(service, request, key)
+        self.wait([future])
+        return None if future.cancelled() else future.result()
 
-    def send(self, service, request, response=False):
-        """Send and forget message to broker"""
-        self.expect_reply = response
+    def request_async(self, service, request, key=None) -> Future:
+        """Send message to broker without waiting for the response.
+        Many requests can be in flight at once, each reply resolves the future
+        with the same correlation id once it is read by wait() or recv().
+        """
+        correlation = str(next(self.correlation_ids)).encode('ascii')
+        future = Future()
+        self.pending[correlation] = future
+        self.send(service, request, correlation, key)
+        return future
+
+    def request_stream(self, service, request) -> Iterator[bytes]:
+        """Send message to broker and yields every chunk of the reply as it arrives.
+        A reply that is not streamed is a single chunk.
+        Raises TimeoutError when no chunk arrives within timeout msecs
+        """
+        correlation = str(next(self.correlation_ids)).encode('ascii')
+        chunks = self.streams[correlation] = deque()
+        try:
+            self.send(service, request, correlation)
+            while True:
+                while not chunks:
+                    if self.recv() is None:
+                        raise TimeoutError(f"No reply from {service} within {self.timeout} msecs")
+                chunk, last = chunks.popleft()
+                yield chunk
+                if last:
+                    return
+        finally:
+            del self.streams[correlation]
+
+    def wait(self, futures: List[Future], timeout=None):
+        """Reads replies until every future is resolved.
+        Futures still unresolved after timeout msecs are cancelled.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + 1e-3 * timeout
+        while not all(future.done() for future in futures):
+            remaining = deadline - time.time()
+            if remaining <= 0 or self.recv(1e3 * remaining) is None:
+                break
+
+        for correlation, future in list(self.pending.items()):
+            if future in futures:
+                del self.pending[correlation]
+                future.cancel()
+
+    def send(self, service, request, correlation=b'', key=None):
+        """Send and forget message to broker.
+        key, e.g. a post id, sends every request with the same key to the same
+        consumer of a group that dispatches by hash.
+        """
         if not isinstance(request, list):
             request = [request]
 
         # Prefix request with protocol frames:
         # Frame 0 - empty (REQ emulation since DEALER dos not append this)
-        # Frame 1 - "MDPCxy" (six bytes, MDP/Client x.y)
+        # Frame 1 - "MDPCxy" (six bytes, MDP/Client x.y), "MDPK01" with a key
         # Frame 2 - Service name
-        # Frame 3 - Request body
-        msg = [b'', MDP.P_PRODUCER, service] + request
+        # Frame 3 - Correlation id, empty when no reply is expected
+        # Frame 4 - Dispatch key, only with "MDPK01"
+        # Frame 4/5 - Request body
+        if key is None:
+            msg = [b'', MDP.P_PRODUCER, service, correlation] + request
+        else:
+            msg = [b'', MDP.P_KEYED, service, correlation, key] + request
         if self.verbose:
             logging.info(f"I: send event {service}, msg: {msg}")
+        if self.client is None:
+            self.reconnect_to_broker()
         self.client.send_multipart(msg)
 
-    def recv(self) -> bytes:
-        """Returns the reply message or None if there was no reply."""
+    def send_batch(self, service, requests: List[bytes]):
+        """Send and forget many messages to one event in a single multipart message.
+        The broker queues each body as its own request.
+        """
+        # Frame 0 - empty
+        # Frame 1 - "MDPB01" batch header
+        # Frame 2 - Service name
+        # Frame 3.. - One request body per frame
+        msg = [b'', MDP.P_BATCH, service] + list(requests)
+        if self.verbose:
+            logging.info(f"I: send batch of {len(requests)} to event {service}")
+        if self.client is None:
+            self.reconnect_to_broker()
+        self.client.send_multipart(msg)
+
+    def recv(self, timeout=None) -> bytes:
+        """Returns the next reply message or None if there was no reply.
+        The reply also resolves the request_async future with the same correlation id,
+        or is queued for the request_stream with that correlation id.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if self.client is None:
+            self.reconnect_to_broker()
         try:
-            items = self.poller.poll(self.timeout)
+            items = self.poller.poll(timeout)
         except KeyboardInterrupt:
             return  # interrupted
 
-        if items and self.expect_reply:
-            self.expect_reply = False
+        if not items:
+            logging.warning(f"W: No reply within {timeout} msecs")
+            return None
 
-            msg = self.client.recv_multipart()
-            if self.verbose:
-                logging.info("I: received reply:")
-                dump(msg)
+        msg = self.client.recv_multipart()
+        if self.verbose:
+            logging.info("I: received reply:")
+            dump(msg)
 
-            # Not trying to handle errors, just asserting noisily
-            assert len(msg) >= 4
-            empty = msg.pop(0)                  # Frame 0 - empty frame
-            assert MDP.P_PRODUCER == msg.pop(0)   # Frame 1 - “MDPC01” (six bytes, representing MDP/Client v0.1)
-            service = msg.pop(0)                # Frame 2 - Service name
+        # Not trying to handle errors, just asserting noisily
+        assert len(msg) >= 5
+        empty = msg.pop(0)                  # Frame 0 - empty frame
+        header = msg.pop(0)                 # Frame 1 - “MDPC01” (six bytes, representing MDP/Client v0.1)
+        assert header in (MDP.P_PRODUCER, MDP.P_STREAM)  # or “MDPS01” for a chunk with more to follow
+        service = msg.pop(0)                # Frame 2 - Service name
+        correlation = msg.pop(0)            # Frame 3 - Correlation id
 
-            if len(msg) == 1:
-                return msg.pop(0)               # Frame 4 - message body
-            else:
-                return msg                      # Frame 4 - message body
+        if len(msg) == 1:
+            reply = msg.pop(0)              # Frame 4 - message body
         else:
-            logging.warning(f"W: Unexpected request: {items}")
+            reply = msg                     # Frame 4 - message body
+
+        chunks = self.streams.get(correlation)
+        if chunks is not None:
+            chunks.append((reply, header == MDP.P_PRODUCER))
+            return reply
+
+        future = self.pending.pop(correlation, None)
+        if future is None:
+            logging.warning(f"W: Unexpected reply from {service}, correlation id: {correlation}")
+        else:
+            future.set_result(reply)
+        return reply
+
+
+class ProducerPool(object):
+    """Thread safe pool of Producers sharing one zmq.Context.
+    ZMQ sockets must not be shared between threads, so every send or request
+    checks out a Producer of its own and returns it afterwards.
+    At most size Producers are created, further threads wait for one to be returned.
+    """
+    size = 8            # Max Producers, so max concurrent requests
+    verbose = False
+
+    def __init__(self, broker, size=size, verbose=False, ctx=None):
+        self.broker = broker
+        self.size = size
+        self.verbose = verbose
+        self.ctx = ctx if ctx is not None else zmq.Context.instance()
+        self.idle = queue.LifoQueue()  # Most recently used first, its socket is connected already
+        self.lock = threading.Lock()
+        self.created = 0
+        self.checkouts = 0      # Metrics
+        self.waits = 0
+        self.wait_time = 0.0
+
+    @contextmanager
+    def producer(self) -> Iterator[Producer]:
+        """Checks out a Producer for the calling thread"""
+        producer = self.checkout()
+        try:
+            yield producer
+        finally:
+            self.idle.put(producer)
+
+    def checkout(self) -> Producer:
+        try:
+            producer = self.idle.get_nowait()
+        except queue.Empty:
+            producer = None
+            with self.lock:
+                if self.created < self.size:
+                    self.created += 1
+                    producer = Producer(self.broker, self.verbose, self.ctx)
+            if producer is None:
+                start = time.time()
+                producer = self.idle.get()
+                with self.lock:
+                    self.waits += 1
+                    self.wait_time += time.time() - start
+        with self.lock:
+            self.checkouts += 1
+        return producer
+
+    def request(self, service, request, key=None) -> bytes:
+        with self.producer() as producer:
+            return producer.request(service, request, key)
+
+    def request_stream(self, service, request) -> Iterator[bytes]:
+        """Keeps one Producer checked out until the whole reply is read"""
+        with self.producer() as producer:
+            yield from producer.request_stream(service, request)
+
+    def send(self, service, request, correlation=b'', key=None):
+        with self.producer() as producer:
+            producer.send(service, request, correlation, key)
+
+    def send_batch(self, service, requests: List[bytes]):
+        with self.producer() as producer:
+            producer.send_batch(service, requests)
+
+    def metrics(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                "size": self.size,
+                "created": self.created,
+                "idle": self.idle.qsize(),
+                "in_use": self.created - self.idle.qsize(),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time
+            }
+
+    def destroy(self):
+        """Closes the sockets of every idle Producer, the context stays for other users.
+        Call once no thread uses the pool anymore.
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.created = 0
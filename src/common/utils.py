@@ -1,6 +1,13 @@
 from binascii import hexlify
 import json
+import logging
 import zmq
+from typing import Dict, List
+
+try:
+	import msgpack
+except ImportError:  # JSON only
+	msgpack = None
 
 
 # Local
@@ -16,6 +23,7 @@ def dump(msg_or_socket):
 		msg = msg_or_socket
 	print("----------------------------------------")
 	for part in msg:
+		part = frame_bytes(part)
 		command = MDP.bytes_commands.get(part)
 		if command is not None:
 			print(f"[%03d] {command}" % len(part))
@@ -27,6 +35,13 @@ def dump(msg_or_socket):
 	print("----------------------------------------")
 
 
+def setup_logging(level=logging.INFO):
+	"""Log format of the services, call once from the entry point of a process"""
+	logging.basicConfig(format="%(asctime)s %(message)s",
+						datefmt="%Y-%m-%d %H:%M:%S",
+						level=level)
+
+
 def bytes_to_command(msg):
 	command = MDP.bytes_commands.get(msg)
 	if command is not None:
@@ -35,18 +50,97 @@ def bytes_to_command(msg):
 		return msg
 
 
-def encode_msg(msg) -> bytes:
-	"""Encodes message to bytes
-	Excepts string like objects"""
-	# msg_ascii = str(msg).encode('ascii')
-	# return base64.b64encode(msg_ascii)
-	return str(msg).encode('ascii')
+class JSONCodec:
+	"""JSON with non-ASCII escaped, always available"""
+	content_type = b"j"
+
+	@staticmethod
+	def encode(msg) -> bytes:
+		return json.dumps(msg).encode('ascii')
+
+	@staticmethod
+	def decode(data):
+		return json.loads(bytes(data))
+
+	@staticmethod
+	def join_list(parts: List[bytes]) -> bytes:
+		"""Encoded list of values that are already encoded"""
+		return b"[" + b",".join(parts) + b"]"
+
+	@staticmethod
+	def join_map(items: Dict[str, bytes]) -> bytes:
+		"""Encoded dict of values that are already encoded"""
+		return b"{" + b",".join(JSONCodec.encode(key) + b":" + value for key, value in items.items()) + b"}"
+
+
+class MsgpackCodec:
+	"""Binary msgpack, only available when msgpack is installed"""
+	content_type = b"m"
+
+	@staticmethod
+	def encode(msg) -> bytes:
+		return msgpack.packb(msg, use_bin_type=True)
+
+	@staticmethod
+	def decode(data):
+		return msgpack.unpackb(data, raw=False)
+
+	@staticmethod
+	def join_list(parts: List[bytes]) -> bytes:
+		return msgpack.Packer().pack_array_header(len(parts)) + b"".join(parts)
+
+	@staticmethod
+	def join_map(items: Dict[str, bytes]) -> bytes:
+		packer = msgpack.Packer(use_bin_type=True)
+		return packer.pack_map_header(len(items)) + b"".join(packer.pack(key) + value for key, value in items.items())
+
+
+# Codecs by content type, the first byte of every encoded message
+CODECS = {JSONCodec.content_type: JSONCodec}
+if msgpack is not None:
+	CODECS[MsgpackCodec.content_type] = MsgpackCodec
+	default_codec = MsgpackCodec
+else:
+	default_codec = JSONCodec
+
+
+def register_codec(codec):
+	"""Adds a codec, it needs a one byte content_type and encode/decode/join_list/join_map functions"""
+	assert len(codec.content_type) == 1
+	CODECS[codec.content_type] = codec
+
+
+def frame_bytes(frame) -> bytes:
+	"""Bytes of a frame received with copy=False, bytes are returned as is"""
+	if isinstance(frame, zmq.Frame):
+		return frame.bytes
+	return frame
+
+
+def encode_msg(msg, codec=None) -> bytes:
+	"""Encodes message to bytes, prefixed with the content type of the codec.
+	Uses default_codec unless another is given."""
+	if codec is None:
+		codec = default_codec
+	return codec.content_type + codec.encode(msg)
+
+
+def codec_of(msg: bytes):
+	"""Codec named by the content type of msg, replies are encoded with the codec of their request.
+	Messages without a known content type, e.g. a bare id, get JSON, which every process reads"""
+	return CODECS.get(bytes(msg[:1]), JSONCodec)
+
+
+def msg_to_dict(msg: bytes):
+	"""Decodes a message from encode_msg with the codec named by its content type"""
+	codec = CODECS.get(msg[:1])
+	if codec is None:
+		return _decode_legacy(msg)
+	return codec.decode(memoryview(msg)[1:])
 
 
-def msg_to_dict(msg: bytes) -> dict:
-	# message_decoded = base64.b64decode(msg).decode('utf8')
+def _decode_legacy(msg: bytes):
+	"""Messages without content type are str() of a dict from older producers"""
 	message_decoded = msg.decode('ascii')
 	json_acceptable_string = message_decoded.replace("'", "\"")
-	message = json.loads(json_acceptable_string)
-	# print(f"message: {message}")
-	return message
+	return json.loads(json_acceptable_string)
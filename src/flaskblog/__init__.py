@@ -1,13 +1,15 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from sqlalchemy import inspect
 
-from common.producerAPI import Producer
+from common.producerAPI import ProducerPool
+from common.database import Database
 
-producer = Producer("tcp://localhost:5555", False)
+BROKER = "tcp://localhost:5555"
+producer = ProducerPool(BROKER)  # Request threads each check out their own socket, connected on first use
 
-db = SQLAlchemy()
+db = Database()
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
@@ -32,11 +34,18 @@ def create_app(config):
     app.register_blueprint(errors)
 
     def init_db():
+        """Creates the schema only when site.db has none, so restarts keep the data.
+        The pooled connection it opens is closed again, forked workers would share it
+        """
         with app.app_context():
-            db.drop_all()
-            db.create_all()
-            db.session.commit()
-        print("DB initialized")
+            if not inspect(db.engine).get_table_names():
+                db.create_all()
+                print("DB initialized")
+            db.engine.dispose()
 
     init_db()
+
+    # Per process on its first request, so every forked worker runs its own listener
+    from flaskblog.users.controller import listen_for_updates
+    app.before_request(lambda: listen_for_updates(BROKER))
     return app
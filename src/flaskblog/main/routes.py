@@ -1,4 +1,4 @@
-from flask import render_template, Blueprint, abort
+from flask import render_template, Blueprint, abort, request
 
 # Local
 from flaskblog.posts import controller
@@ -9,10 +9,12 @@ main = Blueprint('main', __name__)
 @main.route("/")
 @main.route("/home")
 def home():
-    posts = controller.get_all_posts()
-    if isinstance(posts, int):
-        abort(posts)
-    return render_template('home.html', posts=posts)
+    before = request.args.get('before', type=int)
+    page = controller.get_posts_page(before=before)
+    if isinstance(page, int):
+        abort(page)
+    posts, next_page = page
+    return render_template('home.html', posts=posts, next_page=next_page)
 
 
 @main.route("/about")
@@ -5,7 +5,8 @@ from flask_login import UserMixin
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    from flaskblog.users.controller import get_user
+    return get_user(id=int(user_id))
 
 
 class User(db.Model, UserMixin):
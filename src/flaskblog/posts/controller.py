@@ -1,4 +1,4 @@
-from typing import Union, List
+from typing import Union, List, Tuple, Optional, Iterator
 
 from flaskblog.models import Post
 from datetime import datetime
@@ -20,15 +20,16 @@ def save_new_post(post: Post):
 	return True
 
 
-def get_all_posts() -> Union[List[Post], int]:
+PAGE_SIZE = 20      # Posts on one page of the home page
+STREAM_CHUNK = 100  # Posts per reply when streaming every post
+
+
+def decode_reply(message_bytes: bytes, what: str):
 	"""
-	:returns: list of Post on success / Error code on failure
-	:rtypes: List[Post], or int
+	:returns: decoded message on success / Error code on failure
 	"""
-	message_bytes = producer.request(EVENTS.get_all_post, "".encode('utf-8'))
-
 	try:
-		msg = utils.msg_to_dict(message_bytes)
+		return utils.msg_to_dict(message_bytes)
 	except Exception as e:
 		if message_bytes is None:
 			return 404
@@ -37,50 +38,87 @@ def get_all_posts() -> Union[List[Post], int]:
 			if isinstance(code, int):
 				return code
 			else:
-				print(f"Error getting all posts: {e}")
+				print(f"Error getting {what}: {e}")
 				return 500
 
-	posts = []
-	for post in msg:
-		posts.append(
-			Post(
-				id=post["id"],
-				title=post["title"],
-				date_posted=datetime.strptime(post["date_posted"], '%a, %d %b %Y %X '),
-				content=post["content"],
-				user_id=post["user_id"],
-				username=post["username"]
-			)
-		)
+
+def dict_to_post(post: dict) -> Post:
+	return Post(
+		id=post["id"],
+		title=post["title"],
+		date_posted=datetime.utcfromtimestamp(post["date_posted"]),
+		content=post["content"],
+		user_id=post["user_id"],
+		username=post["username"]
+	)
+
+
+def get_all_posts() -> Union[List[Post], int]:
+	"""
+	:returns: list of Post on success / Error code on failure
+	:rtypes: List[Post], or int
+	"""
+	message_bytes = producer.request(EVENTS.get_all_post, utils.encode_msg(None))
+	msg = decode_reply(message_bytes, "all posts")
+	if isinstance(msg, int):
+		return msg
+
+	posts = [dict_to_post(post) for post in msg]
 	print(f"{posts}")
 	return posts
 
 
-def get_post_id(post_id: int):
-	message_bytes = producer.request(EVENTS.get_post, str(post_id).encode('utf-8'))
+def get_posts_page(limit: int = PAGE_SIZE, before: int = None) -> Union[Tuple[List[Post], Optional[int]], int]:
+	"""Newest posts first, after the post with id before
+	:returns: list of Post and cursor for the next page on success / Error code on failure
+	:rtypes: Tuple[List[Post], Optional[int]], or int
+	"""
+	query = {"limit": limit, "before": before}
+	message_bytes = producer.request(EVENTS.get_all_post, utils.encode_msg(query))
+	msg = decode_reply(message_bytes, "posts page")
+	if isinstance(msg, int):
+		return msg
+
+	return [dict_to_post(post) for post in msg["posts"]], msg["next"]
 
+
+def iter_posts(chunk_size: int = STREAM_CHUNK, before: int = None) -> Iterator[Post]:
+	"""Every post newest first, after the post with id before.
+	PostService replies with one message per chunk_size posts, each is decoded as it arrives.
+	Raises LookupError with the error code on failure
+	"""
+	query = {"stream": chunk_size, "before": before}
 	try:
-		msg = utils.msg_to_dict(message_bytes)
-	except Exception as e:
-		if message_bytes is None:
-			return 404
-		else:
-			code = message_bytes.decode('ascii')
-			if isinstance(code, int):
-				return code
-			else:
-				print(f"Error getting all posts: {e}")
-				return 500
+		for message_bytes in producer.request_stream(EVENTS.get_all_post, utils.encode_msg(query)):
+			chunk = decode_reply(message_bytes, "posts chunk")
+			if isinstance(chunk, int):
+				raise LookupError(chunk)
+			for post in chunk:
+				yield dict_to_post(post)
+	except TimeoutError:
+		raise LookupError(504)
+
+
+def post_to_dict(post: Post) -> dict:
+	return {
+		"id": post.id,
+		"title": post.title,
+		"date_posted": post.date_posted.isoformat(),
+		"content": post.content,
+		"user_id": post.user_id,
+		"username": post.username
+	}
 
-	post = Post(
-		id=msg["id"],
-		title=msg["title"],
-		date_posted=datetime.strptime(msg["date_posted"], '%a, %d %b %Y %X '),
-		content=msg["content"],
-		user_id=msg["user_id"],
-		username=msg["username"]
-	)
-	return post
+
+def get_post_id(post_id: int):
+	message_bytes = producer.request(EVENTS.get_post, utils.encode_msg(post_id), key=post_key(post_id))
+	msg = decode_reply(message_bytes, "post")
+	if isinstance(msg, int):
+		return msg
+	if msg is None:
+		return 404
+
+	return dict_to_post(msg)
 
 
 def update_post(post, new_post):
@@ -91,11 +129,16 @@ def update_post(post, new_post):
 		"user_id": post.user_id,
 		"username": post.username
 	}
-	producer.send(EVENTS.update_post, utils.encode_msg(msg))
+	producer.send(EVENTS.update_post, utils.encode_msg(msg), key=post_key(post.id))
 
 
 def delete_post(post_id):
 	msg = {
 		"id": post_id
 	}
-	producer.send(EVENTS.post_deleted, utils.encode_msg(msg))
+	producer.send(EVENTS.post_deleted, utils.encode_msg(msg), key=post_key(post_id))
+
+
+def post_key(post_id) -> bytes:
+	"""Dispatch key of a post, its requests go to the same consumer of a hashed group"""
+	return str(post_id).encode('ascii')
@@ -1,5 +1,8 @@
+import itertools
+import json
+
 from flask import (render_template, url_for, flash,
-                   redirect, request, abort, Blueprint)
+                   redirect, request, abort, Blueprint, Response, stream_with_context)
 
 from flask_login import current_user, login_required
 from flaskblog.models import Post
@@ -79,3 +82,17 @@ def delete_post_route(post_id):
     if cnt.delete_post(post.id):
         flash('Your post has been deleted!', 'success')
     return redirect(url_for('main.home'))
+
+
+@posts.route("/posts/export")
+def export_posts_route():
+    """Every post as JSON lines, newest first.
+    Each chunk PostService streams is written out as it arrives, the full list is never held
+    """
+    all_posts = cnt.iter_posts()
+    try:
+        first = list(itertools.islice(all_posts, 1))  # Errors before the response starts become the status
+    except LookupError as e:
+        abort(e.args[0])
+    lines = (json.dumps(cnt.post_to_dict(post)) + "\n" for post in itertools.chain(first, all_posts))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
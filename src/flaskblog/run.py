@@ -1,8 +1,10 @@
 from flaskblog import create_app
 from flaskblog.config import Config
+from common.utils import setup_logging
 
 
 
+setup_logging()
 app = create_app(Config)
 
 if __name__ == '__main__':
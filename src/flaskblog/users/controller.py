@@ -1,12 +1,17 @@
-from typing import List
+import os
+import time
+import typing
+from collections import OrderedDict
 from datetime import datetime
+from threading import Lock, Thread
+from typing import List, Dict, Tuple, Optional
 
 # Local
 from flaskblog import db
 from flaskblog.models import User, Post
 from flaskblog import producer
 from common.MDP import EVENTS
-from common import utils
+from common import utils, consumerAPI
 
 
 def register_user(user: User):
@@ -26,50 +31,135 @@ def register_user(user: User):
 
 
 def update_user(current_user):
+	user_cache.put(current_user)  # Until user_updated confirms the change
 	user = {
 		"id": current_user.id,
 		"username": current_user.username,
-		"email": current_user.email
+		"email": current_user.email,
+		"image_file": current_user.image_file
 	}
 
 	producer.send(EVENTS.update_user, utils.encode_msg(user))
 
 
-def get_user(**kwargs):
+class UserCache:
+	"""Users fetched from UserService, kept in memory instead of site.db.
+	At most max_entries users are kept, least recently used first out,
+	and each for at most ttl seconds. Looked up by id, username or email.
+	"""
+	fields = ("id", "username", "email")
+
+	def __init__(self, max_entries=1024, ttl=60.0):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.users: typing.OrderedDict[int, Tuple[User, float, list]] = OrderedDict()  # id -> (user, expiry, keys)
+		self.keys: Dict[tuple, int] = {}  # (field, value) -> id
+		self.lock = Lock()  # Requests and the user_updated listener run on different threads
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, field: str, value) -> Optional[User]:
+		with self.lock:
+			user_id = self.keys.get((field, value))
+			entry = self.users.get(user_id)
+			if entry is None or entry[1] < time.time() or getattr(entry[0], field) != value:
+				self.misses += 1
+				return None
+			self.users.move_to_end(user_id)
+			self.hits += 1
+			return entry[0]
+
+	def put(self, user: User):
+		with self.lock:
+			self._discard(user.id)
+			keys = [(field, getattr(user, field)) for field in self.fields]
+			self.users[user.id] = (user, time.time() + self.ttl, keys)
+			for key in keys:
+				self.keys[key] = user.id
+			if len(self.users) > self.max_entries:
+				self._discard(next(iter(self.users)))
+
+	def discard(self, user_id: int):
+		with self.lock:
+			self._discard(user_id)
+
+	def _discard(self, user_id: int):
+		entry = self.users.pop(user_id, None)
+		if entry is not None:
+			for key in entry[2]:  # Keys from put, the user may have been renamed in place since
+				if self.keys.get(key) == user_id:
+					del self.keys[key]
+
+	def __repr__(self):
+		return f"(users: {len(self.users)}, hits: {self.hits}, misses: {self.misses})"
+
+
+user_cache = UserCache()
+
+
+listener_pid = None  # Process the user_updated listener runs in
+listener_lock = Lock()
+
+
+def listen_for_updates(broker: str):
+	"""Drops users from user_cache when UserService announces a change, runs on a daemon thread.
+	Starts once per process, a worker forked by the WSGI server inherits neither the
+	thread nor its socket and starts its own on the first call.
+	"""
+	global listener_pid
+	with listener_lock:
+		if listener_pid == os.getpid():
+			return
+		listener_pid = os.getpid()
+
+	def listen():
+		consumer = consumerAPI.Consumer(broker)
+		consumer.subscribe(EVENTS.user_updated)
+		while True:
+			value, event = consumer.recv()
+			if event == EVENTS.user_updated:
+				user_cache.discard(utils.msg_to_dict(value)["id"])
+				consumer.ready()
+
+	Thread(target=listen, daemon=True).start()
+
+
+def get_user(**kwargs) -> Optional[User]:
 	"""
 	    Keyword Args:
 	        username (string): Users username
 	        id (int): Users ID
 	        email (string): Users Email
+	    :returns: User, or None if UserService does not know it
 	"""
 	data = None
 	for key, value in kwargs.items():
 		data = {key: value}
 
 	if data is not None:  # TODO: improve this
-		# Super duper cache
 		for key, value in data.items():
-			user = User.query.filter_by(**{key: value}).first()
+			user = user_cache.get(key, value)
 			if user:
 				return user
 
 		message_bytes = producer.request(EVENTS.get_user, utils.encode_msg(data))
-		msg = utils.msg_to_dict(message_bytes)
+		msg = utils.msg_to_dict(message_bytes) if message_bytes else None
+		if not isinstance(msg, dict):
+			return None  # UserService replies with an error code
 
 		user = User(
 			id=msg["id"],
 			username=msg["username"],
 			email=msg["email"],
-			image_file="default.jpg",
+			image_file=msg.get("image_file") or "default.jpg",
 			password=msg["password"]
 		)
-		db.session.add(user)
-		db.session.commit()
+		user_cache.put(user)
 		return user
 
 
 def get_users_posts(user_id: int) -> List[dict]:
-	message_bytes = producer.request(EVENTS.get_post_by_user, str(user_id).encode('ascii'))
+	message_bytes = producer.request(EVENTS.get_post_by_user, utils.encode_msg(user_id))
 	msg = utils.msg_to_dict(message_bytes)
 
 	posts = []
@@ -78,7 +168,7 @@ def get_users_posts(user_id: int) -> List[dict]:
 			Post(
 				id=post["id"],
 				title=post["title"],
-				date_posted=datetime.strptime(post["date_posted"], '%a, %d %b %Y %X '),
+				date_posted=datetime.utcfromtimestamp(post["date_posted"]),
 				content=post["content"],
 				user_id=post["user_id"],
 				username=post["username"]
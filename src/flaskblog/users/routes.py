@@ -1,6 +1,6 @@
 from flask import render_template, url_for, flash, redirect, request, Blueprint
 from flask_login import login_user, current_user, logout_user, login_required
-from flaskblog import db, bcrypt
+from flaskblog import bcrypt
 from flaskblog.models import User
 from flaskblog.users.forms import RegistrationForm, LoginForm, UpdateAccountForm
 from flaskblog.users.utils import save_picture
@@ -56,11 +56,8 @@ def account():
             picture_file = save_picture(form.picture.data)
             current_user.image_file = picture_file
 
-        # Saves user in "cache"
         current_user.username = form.username.data
         current_user.email = form.email.data
-        db.session.commit()
-
         cnt.update_user(current_user)
 
         flash('Your account has been updated!', 'success')
@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+
+import zmq
+import zmq.asyncio
+
+from src.common import MDP
+from src.common.asyncConsumerAPI import AsyncConsumer
+
+
+class TestAsyncConsumer(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the asyncio consumer against a bare ROUTER socket standing in for the broker"""
+
+    async def asyncSetUp(self):
+        self.broker = zmq.asyncio.Context.instance().socket(zmq.ROUTER)
+        self.broker.linger = 0
+        self.broker.bind("tcp://127.0.0.1:*")
+        self.consumer = AsyncConsumer(self.broker.last_endpoint.decode(), concurrency=2)
+        self.running = None
+
+    async def asyncTearDown(self):
+        self.consumer.stop()
+        if self.running is not None:
+            await asyncio.wait_for(self.running, 1)
+        self.consumer.destroy()
+        self.broker.close()
+
+    async def start(self, *events):
+        """Runs the consumer and returns its address once it subscribed to events"""
+        self.consumer.heartbeat = 100
+        self.running = asyncio.ensure_future(self.consumer.run())
+        subscribed = set()
+        while subscribed != set(events):
+            address, empty, header, command, *rest = await asyncio.wait_for(self.broker.recv_multipart(), 1)
+            if command == MDP.W_READY and rest:
+                subscribed.add(rest[0])
+        return address
+
+    async def request(self, address, correlation, body, event):
+        await self.broker.send_multipart([address, b'', MDP.C_CONSUMER, MDP.W_REQUEST,
+                                          b"client", correlation, b'', body, event])
+
+    async def replies(self, count):
+        """Next count replies as (correlation id, body)"""
+        replies = []
+        while len(replies) < count:
+            msg = await asyncio.wait_for(self.broker.recv_multipart(), 1)
+            if msg[3] == MDP.W_REPLY:
+                replies.append((msg[5], msg[7]))
+        return replies
+
+    async def test_request_runs_handler_of_its_event(self):
+        self.consumer.subscribe(b"upper", lambda body: body.upper())
+
+        @self.consumer.on(b"ignore")
+        async def ignore(body):
+            return None
+
+        address = await self.start(b"upper", b"ignore")
+        await self.request(address, b"1", b"post", b"upper")
+        await self.request(address, b"2", b"post", b"ignore")
+        self.assertEqual(sorted(await self.replies(2)), [(b"1", b"POST"), (b"2", b"")])
+
+    async def test_concurrency_limits_running_handlers(self):
+        running, most, release = 0, 0, asyncio.Event()
+
+        @self.consumer.on(b"slow")
+        async def slow(body):
+            nonlocal running, most
+            running += 1
+            most = max(most, running)
+            await release.wait()
+            running -= 1
+            return body
+
+        address = await self.start(b"slow")
+        for i in range(4):
+            await self.request(address, str(i).encode(), b"x", b"slow")
+        await asyncio.sleep(0.1)
+        self.assertEqual(running, 2)
+
+        release.set()
+        self.assertEqual(len(await self.replies(4)), 4)
+        self.assertEqual(most, 2)
+
+    async def test_reconnects_when_broker_goes_quiet(self):
+        self.consumer.subscribe(b"test", lambda body: body)
+        self.consumer.reconnect = 10
+        address = await self.start(b"test")
+
+        # The broker never answers heartbeats, after liveness runs out the consumer registers again
+        resubscribed = False
+        while not resubscribed:
+            new_address, empty, header, command, *rest = await asyncio.wait_for(self.broker.recv_multipart(), 2)
+            resubscribed = command == MDP.W_READY and rest == [b"test"]
+        self.assertNotEqual(new_address, address)
+        self.assertFalse(self.running.done())
+
+        # The new socket still serves requests
+        await self.request(new_address, b"1", b"ok", b"test")
+        self.assertEqual(await self.replies(1), [(b"1", b"ok")])
+
+
+if __name__ == '__main__':
+    unittest.main()
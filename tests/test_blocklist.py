@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from src.FilterService.blocklist import Blocklist, BlocklistFile
+from src.FilterService.filter import FilterPool
+
+
+class TestBlocklist(unittest.TestCase):
+    """Test cases for censoring posts"""
+
+    def setUp(self):
+        self.blocklist = Blocklist(["naughty", "Putin", "spam", "spa"])
+
+    def test_censors_whole_words_ignoring_case(self):
+        content, hits = self.blocklist.censor("SPAM, naughty spa! Putin's spammer")
+        self.assertEqual(content, "****, ******* ***! *****'s spammer")
+        self.assertEqual(hits, 4)
+
+    def test_clean_content_is_unchanged(self):
+        self.assertEqual(self.blocklist.censor("nothing to see"), ("nothing to see", 0))
+
+    def test_empty_blocklist(self):
+        self.assertEqual(Blocklist([]).censor("spam"), ("spam", 0))
+
+
+class TestBlocklistFile(unittest.TestCase):
+    """Test cases for reloading the blocklist from a file"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.swapped = []
+        self.file = BlocklistFile(os.path.join(self.dir.name, "blocklist.txt"), self.swapped.append)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_reloads_only_when_changed(self):
+        self.assertFalse(self.file.check())  # No file yet
+
+        self.file.save(["spam"])
+        self.assertTrue(self.file.check())
+        self.assertFalse(self.file.check())
+        self.assertEqual(self.swapped[-1].censor("spam"), ("****", 1))
+
+        self.file.save(["eggs"])
+        self.assertTrue(self.file.check())
+        self.assertEqual(self.swapped[-1].censor("spam eggs"), ("spam ****", 1))
+
+    def test_pool_shares_a_temporary_blocklist_file(self):
+        pool = FilterPool("tcp://localhost:5599", ["spam"], processes=2)
+        pool.seed_blocklist()
+        self.assertEqual(BlocklistFile(pool.blocklist_file, None).read(), ["spam"])
+
+        pool.stop()
+        self.assertFalse(os.path.exists(pool.blocklist_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,333 @@
+import unittest
+
+from src.Broker.broker import MessageBroker, WaitingGroup, ReplyCache, RoundRobinDispatch, \
+    LeastOutstandingDispatch, ConsistentHashDispatch, Request
+from src.common import MDP
+
+
+class TestBrokerState(unittest.TestCase):
+    """Test cases for broker bookkeeping, no sockets are connected"""
+
+    def setUp(self) -> None:
+        self.broker = MessageBroker()
+
+    def tearDown(self) -> None:
+        self.broker.destroy()
+
+    def test_purge_stops_at_first_alive(self):
+        first = self.broker.require_consumer(b"first")
+        second = self.broker.require_consumer(b"second")
+
+        # Heartbeat moves first to the back of the expiry order
+        self.broker.refresh_consumer(first)
+        second.expiry = 0
+        self.broker.purge_consumers()
+
+        self.assertEqual(list(self.broker.Consumers.values()), [first])
+
+    def test_waiting_group_remove(self):
+        a, b, c = (self.broker.require_consumer(name) for name in (b"a", b"b", b"c"))
+        group = WaitingGroup([a, b, c])
+        group.append(a)  # Already waiting, not added twice
+
+        group.remove(a)
+        self.assertEqual(len(group), 2)
+        self.assertNotIn(a, group)
+        self.assertEqual(set(group), {b, c})
+        with self.assertRaises(ValueError):
+            group.remove(a)
+
+    def test_credit_limits_in_flight(self):
+        event = self.broker.require_event(b"test")
+        consumer = self.broker.require_consumer(b"consumer")
+        consumer.credit = 2
+        consumer.events.append(event)
+        self.broker.consumer_waiting(consumer)
+
+        for _ in range(3):
+            self.broker.dispatch(event, [b"client", b"1", b'', b"body"])
+        self.assertEqual(consumer.in_flight, 2)
+        self.assertEqual(len(event.backlog[consumer]), 1)
+        self.assertNotIn(consumer, event.waiting[b"all"])
+
+        # A reply hands back one credit and the queued request goes out
+        self.broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"1", b'', b'', b"test"])
+        self.assertEqual(consumer.in_flight, 2)
+        self.assertEqual(len(event.backlog[consumer]), 0)
+
+    def test_batch_queues_each_body(self):
+        self.broker.process_message([b"client", b'', MDP.P_BATCH, b"test", b"1", b"2", b"3"])
+
+        requests = self.broker.Events[b"test"].requests
+        self.assertEqual([r[-1] for r in requests], [b"1", b"2", b"3"])
+        self.assertEqual(requests[0][:3], [b"client", b'', b''])
+
+    def test_reply_keeps_correlation_id(self):
+        event = self.broker.require_event(b"test")
+        consumer = self.broker.require_consumer(b"consumer")
+        consumer.events.append(event)
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+
+        self.broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"7", b'', b"reply", b"test"])
+        self.assertEqual(sent, [[b"client", b'', MDP.P_PRODUCER, b"test", b"7", b"reply"]])
+
+    def test_reply_with_several_frames_is_forwarded(self):
+        event = self.broker.require_event(b"test")
+        consumer = self.broker.require_consumer(b"consumer")
+        consumer.events.append(event)
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+
+        self.broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"7", b'', b"1", b"2", b"test"])
+        self.assertEqual(sent, [[b"client", b'', MDP.P_PRODUCER, b"test", b"7", b"1", b"2"]])
+
+    def test_reply_without_envelope_is_dropped(self):
+        consumer = self.broker.require_consumer(b"consumer")
+        consumer.in_flight = 1
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+
+        self.broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"test"])
+        self.assertEqual(sent, [])
+        self.assertEqual(consumer.in_flight, 0)
+
+    def test_streamed_reply_keeps_request_in_flight(self):
+        self.broker.reply_cache = ReplyCache()
+        event = self.broker.require_event(MDP.EVENTS.get_all_post)
+        consumer = self.broker.require_consumer(b"consumer")
+        consumer.events.append(event)
+        consumer.in_flight = 1
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+        self.broker.reply_cache.expect(b"client", b"7", MDP.EVENTS.get_all_post, b"stream")
+
+        for chunk in (b"1", b"2"):
+            self.broker.process_consumer(consumer.address, [MDP.W_PARTIAL, b"client", b"7", b'', chunk, MDP.EVENTS.get_all_post])
+        self.assertEqual(consumer.in_flight, 1)
+        self.broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"7", b'', b"3", MDP.EVENTS.get_all_post])
+        self.assertEqual(consumer.in_flight, 0)
+
+        self.assertEqual([frames[2] for frames in sent], [MDP.P_STREAM, MDP.P_STREAM, MDP.P_PRODUCER])
+        self.assertEqual([frames[5] for frames in sent], [b"1", b"2", b"3"])
+        self.assertEqual(len(self.broker.reply_cache.entries), 0)  # Only the last chunk would be cached
+
+    def test_ready_is_acknowledged(self):
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+
+        self.broker.process_consumer(b"consumer", [MDP.W_READY])
+        self.broker.process_consumer(b"consumer", [MDP.W_GROUP, b"group"])
+        self.assertEqual(sent, [[b"consumer", b'', MDP.C_CONSUMER, MDP.W_ACK, MDP.W_READY],
+                                [b"consumer", b'', MDP.C_CONSUMER, MDP.W_ACK, MDP.W_GROUP]])
+
+    def test_unknown_heartbeat_is_disconnected(self):
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+
+        self.broker.process_consumer(b"stranger", [MDP.W_HEARTBEAT])
+        self.assertEqual(sent, [[b"stranger", b'', MDP.C_CONSUMER, MDP.W_DISCONNECT]])
+        self.assertEqual(len(self.broker.Consumers), 0)
+
+    def test_reply_cache_answers_repeated_reads(self):
+        self.broker.reply_cache = ReplyCache()
+        event = self.broker.require_event(MDP.EVENTS.get_post)
+        consumer = self.broker.require_consumer(b"consumer")
+        consumer.group = MDP.GROUP.post_group
+        consumer.events.append(event)
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+
+        self.broker.process_message([b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.get_post, b"1", b"post"])
+        self.broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"1", b'', b"reply", MDP.EVENTS.get_post])
+        self.broker.process_message([b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.get_post, b"2", b"post"])
+        self.assertEqual(sent[-1], [b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.get_post, b"2", b"reply"])
+        self.assertEqual(self.broker.reply_cache.hits, 1)
+
+        self.broker.process_message([b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.post_updated, b'', b"post"])
+        self.broker.process_message([b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.get_post, b"3", b"post"])
+        self.assertEqual(sent[-1][3], MDP.W_REQUEST)  # Evicted, so the read goes to the consumer
+        self.assertEqual(self.broker.reply_cache.misses, 2)
+
+    def test_read_after_write_request_is_not_cached(self):
+        self.broker.reply_cache = ReplyCache()
+        event = self.broker.require_event(MDP.EVENTS.get_all_post)
+        consumer = self.broker.require_consumer(b"consumer")
+        consumer.group = MDP.GROUP.post_group
+        consumer.events.append(event)
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames)
+
+        self.broker.process_message([b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.get_all_post, b"1", b"page"])
+        self.broker.process_consumer(consumer.address, [MDP.W_REPLY, b"client", b"1", b'', b"old", MDP.EVENTS.get_all_post])
+
+        # The web tier redirects to the home page right after sending save_post
+        self.broker.process_message([b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.save_post, b'', b"post"])
+        self.broker.process_message([b"client", b'', MDP.P_PRODUCER, MDP.EVENTS.get_all_post, b"2", b"page"])
+        self.assertEqual(sent[-1][3], MDP.W_REQUEST)
+        self.assertEqual(self.broker.reply_cache.hits, 0)
+
+    def test_batched_write_evicts_reply_cache(self):
+        self.broker.reply_cache = ReplyCache()
+        self.broker.reply_cache.expect(b"client", b"1", MDP.EVENTS.get_post, b"post")
+        self.broker.reply_cache.put(b"client", b"1", b"reply")
+        self.broker.socket.send_multipart = lambda frames, **kwargs: None
+
+        self.broker.process_message([b"client", b'', MDP.P_BATCH, MDP.EVENTS.post_updated, b"1", b"2"])
+        self.assertIsNone(self.broker.reply_cache.get(MDP.EVENTS.get_post, b"post"))
+
+    def grouped_consumers(self, event, n):
+        consumers = []
+        for i in range(n):
+            consumer = self.broker.require_consumer(bytes([i]))
+            consumer.group = b"group"
+            consumer.events.append(event)
+            self.broker.consumer_waiting(consumer)
+            consumers.append(consumer)
+        return consumers
+
+    def dispatched_to(self, event, bodies, keyed=False):
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames[0])
+        for body in bodies:
+            msg = [b"client", b"1", b'', body]
+            self.broker.dispatch(event, Request(msg, key=body) if keyed else msg)
+        return sent
+
+    def test_round_robin_dispatch(self):
+        self.broker.set_dispatch(b"test", b"group", RoundRobinDispatch)
+        event = self.broker.require_event(b"test")
+        consumers = self.grouped_consumers(event, 4)
+
+        sent = self.dispatched_to(event, [b"body"] * 8)
+        self.assertEqual(sorted(sent), sorted([c.address for c in consumers] * 2))
+
+    def test_least_outstanding_dispatch(self):
+        event = self.broker.require_event(b"test")
+        busy, idle = self.grouped_consumers(event, 2)
+        self.broker.set_dispatch(b"test", b"group", LeastOutstandingDispatch)
+        busy.in_flight = 3
+
+        sent = self.dispatched_to(event, [b"body"] * 3)
+        self.assertEqual(sent, [idle.address] * 3)
+
+    def test_consistent_hash_dispatch(self):
+        self.broker.set_dispatch(b"test", b"group", ConsistentHashDispatch)
+        event = self.broker.require_event(b"test")
+        self.grouped_consumers(event, 4)
+
+        keys = [str(i).encode() for i in range(50)]
+        first = self.dispatched_to(event, keys, keyed=True)
+        self.assertEqual(self.dispatched_to(event, keys, keyed=True), first)
+        self.assertGreater(len(set(first)), 1)
+
+    def test_consistent_hash_waits_for_busy_owner(self):
+        self.broker.set_dispatch(b"test", b"group", ConsistentHashDispatch)
+        event = self.broker.require_event(b"test")
+        consumers = self.grouped_consumers(event, 2)
+        for consumer in consumers:
+            consumer.credit = 1
+        owner, = set(self.dispatched_to(event, [b"42"], keyed=True))
+
+        # The owner is out of credit, the other consumer does not take its key
+        self.assertEqual(self.dispatched_to(event, [b"42"], keyed=True), [])
+        sent = []
+        self.broker.socket.send_multipart = lambda frames, **kwargs: sent.append(frames[0])
+        self.broker.process_consumer(owner, [MDP.W_REPLY, b"client", b"1", b'', b'', b"test"])
+        self.assertEqual(sent, [owner])
+
+    def test_keyed_request_frame_is_not_forwarded(self):
+        self.broker.set_dispatch(b"test", b"group", ConsistentHashDispatch)
+        event = self.broker.require_event(b"test")
+        consumer, = self.grouped_consumers(event, 1)
+        frames = []
+        self.broker.socket.send_multipart = lambda msg, **kwargs: frames.append(msg)
+
+        self.broker.process_message([b"client", b'', MDP.P_KEYED, b"test", b"1", b"42", b"body"])
+        self.assertEqual(frames, [[consumer.address, b'', MDP.C_CONSUMER, MDP.W_REQUEST,
+                                   b"client", b"1", b'', b"body", b"test"]])
+
+    def test_broadcast_reaches_every_ungrouped_consumer(self):
+        event = self.broker.require_event(b"test")
+        listeners = []
+        for name in (b"a", b"b", b"c"):
+            consumer = self.broker.require_consumer(name)
+            consumer.events.append(event)
+            self.broker.consumer_waiting(consumer)
+            listeners.append(consumer)
+        grouped, = self.grouped_consumers(event, 1)
+        frames, sent = [], []
+
+        def send(frame, flags=0, **kwargs):
+            frames.append(frame)
+            if not flags:  # Last frame of a message
+                sent.append(frames[:])
+                frames.clear()
+        self.broker.socket.send = send
+        self.broker.socket.send_multipart = lambda msg, **kwargs: sent.append(msg)
+
+        self.broker.dispatch(event, [b"client", b"1", b'', b"body"])
+        self.assertEqual([msg[0] for msg in sent].count(grouped.address), 1)  # The group still gets one copy
+        self.assertEqual(sorted(msg for msg in sent if msg[0] != grouped.address), [[address, b'', MDP.C_CONSUMER, MDP.W_REQUEST, b"client", b"1", b'', b"body", b"test"]
+                                            for address in (b"a", b"b", b"c")])
+        self.assertTrue(all(consumer.in_flight == 1 for consumer in listeners))
+
+    def test_saturated_group_keeps_its_requests(self):
+        event = self.broker.require_event(MDP.EVENTS.user_updated)
+        posts = self.broker.require_consumer(b"posts")
+        posts.group, posts.credit = MDP.GROUP.post_group, 1
+        filters = self.broker.require_consumer(b"filters")
+        filters.group = MDP.GROUP.filter_group
+        for consumer in (posts, filters):
+            consumer.events.append(event)
+            self.broker.consumer_waiting(consumer)
+        sent = []
+
+        def send(frames, **kwargs):
+            if frames[3] == MDP.W_REQUEST:
+                sent.append((frames[0], frames[7]))  # Consumer address, request body
+        self.broker.socket.send_multipart = send
+
+        for body in (b"1", b"2", b"3"):
+            self.broker.dispatch(event, [b"client", b'', b'', body])
+        self.assertEqual([body for address, body in sent if address == b"filters"], [b"1", b"2", b"3"])
+        self.assertEqual([body for address, body in sent if address == b"posts"], [b"1"])
+
+        # Every reply from the busy group lets its next queued request out
+        for _ in range(2):
+            self.broker.process_consumer(b"posts", [MDP.W_REPLY, b"client", b'', b'', b'', MDP.EVENTS.user_updated])
+        self.assertEqual([body for address, body in sent if address == b"posts"], [b"1", b"2", b"3"])
+        self.assertEqual(len(event.queues[MDP.GROUP.post_group]), 0)
+
+    def test_group_queue_goes_with_its_last_consumer(self):
+        event = self.broker.require_event(MDP.EVENTS.post_saved)
+        filters, = self.grouped_consumers(event, 1)
+        filters.credit = 1
+        self.broker.socket.send_multipart = lambda frames, **kwargs: None
+        for body in (b"1", b"2"):
+            self.broker.dispatch(event, [b"client", b'', b'', body])
+        self.assertEqual(len(event.queues[b"group"]), 1)
+
+        self.broker.process_consumer(filters.address, [MDP.W_DISCONNECT])
+        self.assertNotIn(b"group", event.queues)
+
+        # With no subscriber left writes wait for the next one, reads are not kept
+        self.broker.dispatch(event, [b"client", b'', b'', b"write"])
+        self.broker.dispatch(event, [b"client", b"1", b'', b"read"])
+        self.assertEqual([msg[-1] for msg in event.requests], [b"write"])
+
+    def test_full_queue_drops_oldest(self):
+        self.broker.max_queued = 3
+        event = self.broker.require_event(b"test")
+        consumer, = self.grouped_consumers(event, 1)
+        consumer.credit = 1
+        self.broker.socket.send_multipart = lambda frames, **kwargs: None
+
+        for body in range(6):
+            self.broker.dispatch(event, [b"client", b'', b'', str(body).encode()])
+        self.assertEqual([msg[-1] for msg in event.queues[b"group"]], [b"3", b"4", b"5"])  # 0 was sent
+        self.assertEqual(event.dropped, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,7 @@ class TestBroker(unittest.TestCase):
 
     def setUp(self) -> None:
         self.broker = MessageBroker()
+        self.broker.HEARTBEAT_INTERVAL = 100  # Polls return soon after mediating is cleared
         self.broker.bind("tcp://*:5555")
         self.brokerThread = Thread(target=self.broker.mediate)
         self.brokerThread.start()
@@ -24,11 +25,10 @@ class TestBroker(unittest.TestCase):
         self.event = b"test"
 
     def tearDown(self) -> None:
-        # Stop broker
+        # Stop broker, its thread must be done with the socket before it is destroyed
         self.broker.mediating = False
-        self.broker.destroy()
-
         self.brokerThread.join()
+        self.broker.destroy()
 
         print(self.brokerThread.is_alive())
 
@@ -56,6 +56,19 @@ class TestBroker(unittest.TestCase):
         self.assertTrue(value == msg)
         self.assertTrue(event == self.event)
 
+    def test_streamed_reply(self):
+        self.consumer.subscribe(self.event)
+
+        def serve():
+            value, event = self.consumer.recv()
+            self.consumer.reply_stream(iter([b"1", b"2", value]))
+        consumer = Thread(target=serve, daemon=True)
+        consumer.start()
+
+        chunks = list(self.producer.request_stream(self.event, b"3"))
+        consumer.join(1)
+        self.assertEqual(chunks, [b"1", b"2", b"3"])
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from src.PostService import post_service
+from src.PostService.post_service import db, Post, EVENTS
+from src.common import utils
+
+
+class TestPostService(unittest.TestCase):
+    """Test cases for PostService requests against a temporary posts.db"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.uri = post_service.app.config['SQLALCHEMY_DATABASE_URI']
+        post_service.app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(self.tmp.name, 'posts.db')}"
+        self.context = post_service.app.app_context()
+        self.context.push()
+        db.create_all()
+        post_service.encoded_posts.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.context.pop()
+        post_service.app.config['SQLALCHEMY_DATABASE_URI'] = self.uri
+        self.tmp.cleanup()
+
+    def add_posts(self, n, user_id=1):
+        for i in range(n):
+            db.session.add(Post(title=f"title {i}", content="content", user_id=user_id, username="user"))
+        db.session.commit()
+
+    @staticmethod
+    def new_post(title, user_id=1):
+        return utils.encode_msg({"title": title, "content": "content", "user_id": user_id, "username": "user"})
+
+    def titles(self):
+        return [post.title for post in Post.query.order_by(Post.id)]
+
+    def test_batch_commits_every_write(self):
+        outbox = []
+        replies = post_service.handle_batch([(self.new_post("a"), EVENTS.save_post),
+                                             (self.new_post("b"), EVENTS.save_post)], outbox)
+        self.assertEqual(replies, [None, None])
+        self.assertEqual(self.titles(), ["a", "b"])
+        self.assertEqual([event for event, _ in outbox], [EVENTS.post_saved] * 2)
+
+    def test_read_in_batch_sees_earlier_write(self):
+        replies = post_service.handle_batch([(self.new_post("a"), EVENTS.save_post),
+                                             (utils.encode_msg(1), EVENTS.get_post)], [])
+        self.assertEqual(utils.msg_to_dict(replies[1])["title"], "a")
+
+    def test_failing_batch_retries_one_at_a_time(self):
+        outbox = []
+        missing = utils.encode_msg({"id": 99, "title": "x", "content": "x"})
+        with self.assertLogs(level="ERROR") as logs:
+            replies = post_service.handle_batch([(self.new_post("a"), EVENTS.save_post),
+                                                 (missing, EVENTS.update_post),
+                                                 (self.new_post("b"), EVENTS.save_post),
+                                                 (utils.encode_msg(1), EVENTS.get_post)], outbox)
+        self.assertEqual(len(logs.output), 2)  # The group commit, then the failed request
+        self.assertIsNone(replies[1])
+        self.assertEqual(utils.msg_to_dict(replies[3])["title"], "a")
+        self.assertEqual(self.titles(), ["a", "b"])
+        # Only the committed writes send their events, nothing from the failed attempt
+        posts = [(event, utils.msg_to_dict(msg)["title"]) for event, msg in outbox]
+        self.assertEqual(posts, [(EVENTS.post_saved, "a"), (EVENTS.post_saved, "b")])
+
+    def test_update_users_renames_posts(self):
+        self.add_posts(2, user_id=1)
+        self.add_posts(1, user_id=2)
+        post_service.get_post(1)  # Cached with the old username
+        post_service.handle_batch([(utils.encode_msg({"id": 1, "username": "first"}), EVENTS.user_updated),
+                                   (utils.encode_msg({"id": 1, "username": "last"}), EVENTS.user_updated),
+                                   (utils.encode_msg({"id": 2, "username": "other"}), EVENTS.user_updated)], [])
+        self.assertEqual([post.username for post in Post.query.order_by(Post.id)], ["last", "last", "other"])
+        self.assertEqual(utils.msg_to_dict(post_service.get_post(1))["username"], "last")
+
+    def test_encoded_posts_are_reused(self):
+        self.add_posts(3)
+        cache = post_service.EncodedPosts(max_entries=2)
+        first = cache.get_ids([1, 2])
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(cache.get_ids([2, 1]), first[::-1])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        cache.get_ids([3])  # Evicts 2, the least recently used
+        cache.get_ids([1, 2])
+        self.assertEqual((cache.hits, cache.misses), (3, 4))
+
+    def test_encoded_posts_expire_and_skip_deleted(self):
+        self.add_posts(2)
+        cache = post_service.EncodedPosts(ttl=-1)
+        cache.get_ids([1])
+        cache.get_ids([1])
+        self.assertEqual(cache.hits, 0)
+        db.session.delete(Post.query.get(2))
+        db.session.commit()
+        self.assertEqual([utils.msg_to_dict(cache.message(part))["id"] for part in cache.get_ids([2, 1])], [1])
+
+    def test_pages_end_with_no_cursor(self):
+        self.add_posts(5)
+        page = utils.msg_to_dict(post_service.handle(EVENTS.get_all_post, utils.encode_msg({"limit": 2}), []))
+        self.assertEqual(([post["id"] for post in page["posts"]], page["next"]), ([5, 4], 4))
+        page = utils.msg_to_dict(post_service.get_posts_page(2, 2))
+        self.assertEqual(([post["id"] for post in page["posts"]], page["next"]), ([1], None))
+
+    def test_missing_post_is_none(self):
+        self.assertIsNone(utils.msg_to_dict(post_service.handle(EVENTS.get_post, utils.encode_msg(1), [])))
+
+    def test_stream_replies_one_message_per_chunk(self):
+        self.add_posts(5)
+        chunks = post_service.handle(EVENTS.get_all_post, utils.encode_msg({"stream": 2}), [])
+        ids = [[post["id"] for post in utils.msg_to_dict(chunk)] for chunk in chunks]
+        self.assertEqual(ids, [[5, 4], [3, 2], [1]])
+
+    def test_stream_starts_at_cursor(self):
+        self.add_posts(5)
+        chunks = post_service.handle(EVENTS.get_all_post, utils.encode_msg({"stream": 10, "before": 3}), [])
+        self.assertEqual([[post["id"] for post in utils.msg_to_dict(chunk)] for chunk in chunks], [[2, 1]])
+
+    def test_pages_follow_date_posted(self):
+        for i, day in enumerate([3, 1, 2, 2]):
+            db.session.add(Post(title=f"title {i}", content="content", user_id=1, username="user",
+                                date_posted=datetime(2020, 1, day)))
+        db.session.commit()
+        ids, before = [], None
+        while True:
+            page = utils.msg_to_dict(post_service.get_posts_page(1, before))
+            ids += [post["id"] for post in page["posts"]]
+            before = page["next"]
+            if before is None:
+                break
+        self.assertEqual(ids, [1, 4, 3, 2])
+
+    def test_empty_stream_still_replies(self):
+        chunks = list(post_service.handle(EVENTS.get_all_post, utils.encode_msg({"stream": 10}), []))
+        self.assertEqual([utils.msg_to_dict(chunk) for chunk in chunks], [[]])
+
+    def test_reply_in_codec_of_request(self):
+        self.add_posts(2)
+        for codec in utils.CODECS.values():
+            with self.subTest(codec=codec.__name__):
+                reply = post_service.handle(EVENTS.get_post, utils.encode_msg(2, codec), [])
+                self.assertEqual(reply[:1], codec.content_type)
+                self.assertEqual(utils.msg_to_dict(reply)["id"], 2)
+                page = post_service.handle(EVENTS.get_all_post, utils.encode_msg({"limit": 1}, codec), [])
+                self.assertEqual(utils.msg_to_dict(page)["next"], 2)
+
+    def test_request_without_content_type_gets_json(self):
+        self.add_posts(1)
+        reply = post_service.handle(EVENTS.get_post, b"1", [])
+        self.assertEqual(reply[:1], utils.JSONCodec.content_type)
+        self.assertEqual(utils.msg_to_dict(reply)["id"], 1)
+
+    def test_write_discards_post_in_every_codec(self):
+        self.add_posts(1)
+        for codec in utils.CODECS.values():
+            post_service.handle(EVENTS.get_post, utils.encode_msg(1, codec), [])
+        post_service.handle(EVENTS.update_post, utils.encode_msg({"id": 1, "title": "new", "content": "new"}), [])
+        for codec in utils.CODECS.values():
+            with self.subTest(codec=codec.__name__):
+                reply = post_service.handle(EVENTS.get_post, utils.encode_msg(1, codec), [])
+                self.assertEqual(utils.msg_to_dict(reply)["title"], "new")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+
+from src.flaskblog.posts import controller
+from src.common import utils
+
+
+class TestPostsController(unittest.TestCase):
+    """Test cases for the webservice side of post requests, with the producer mocked"""
+
+    post = {"id": 1, "title": "title", "date_posted": 0, "content": "content", "user_id": 2, "username": "user2"}
+
+    def replies(self, chunks):
+        producer = mock.Mock()
+        producer.request_stream.return_value = chunks
+        return mock.patch.object(controller, "producer", producer)
+
+    def test_iter_posts_decodes_each_chunk(self):
+        decoded = []
+        chunks = [utils.encode_msg([dict(self.post, id=i) for i in ids]) for ids in ([3, 2], [1])]
+
+        def stream():
+            for chunk in chunks:
+                decoded.append(len(decoded))
+                yield chunk
+
+        with self.replies(stream()):
+            posts = controller.iter_posts(chunk_size=2)
+            self.assertEqual(next(posts).id, 3)
+            self.assertEqual(decoded, [0])  # The second chunk is not read yet
+            self.assertEqual([post.id for post in posts], [2, 1])
+
+    def test_iter_posts_raises_error_code(self):
+        def stream():
+            raise TimeoutError()
+            yield
+
+        with self.replies(stream()):
+            with self.assertRaises(LookupError) as error:
+                list(controller.iter_posts())
+        self.assertEqual(error.exception.args, (504,))
+
+
+if __name__ == '__main__':
+    unittest.main()
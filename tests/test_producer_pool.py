@@ -0,0 +1,48 @@
+import unittest
+from threading import Thread
+
+from src.common.producerAPI import Producer, ProducerPool
+
+
+class TestProducerPool(unittest.TestCase):
+    """Test cases for sharing producers between threads"""
+
+    def setUp(self):
+        self.pool = ProducerPool("tcp://localhost:5599", size=2)
+
+    def tearDown(self):
+        self.pool.destroy()
+
+    def test_returned_producer_is_reused(self):
+        with self.pool.producer() as first:
+            pass
+        with self.pool.producer() as second:
+            self.assertIs(first, second)
+        self.assertEqual(self.pool.metrics()["created"], 1)
+        self.assertEqual(self.pool.metrics()["checkouts"], 2)
+
+    def test_threads_never_share_a_producer(self):
+        checked_out = []
+        with self.pool.producer() as first, self.pool.producer() as second:
+            self.assertIsNot(first, second)
+            waiter = Thread(target=lambda: checked_out.append(self.pool.checkout()))
+            waiter.start()
+            waiter.join(0.1)
+            self.assertTrue(waiter.is_alive())  # Pool is exhausted
+        waiter.join(1)
+        self.assertIn(checked_out[0], (first, second))
+        self.assertEqual(self.pool.metrics()["waits"], 1)
+        self.assertEqual(self.pool.metrics()["created"], 2)
+
+    def test_destroy_leaves_shared_context_alone(self):
+        other = Producer("tcp://localhost:5599")
+        other.send(b"test", b"body")
+        other.destroy()
+
+        self.assertFalse(self.pool.ctx.closed)
+        self.pool.send(b"test", b"body")  # Sockets of the pool still work
+        self.assertEqual(self.pool.metrics()["created"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
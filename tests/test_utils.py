@@ -0,0 +1,45 @@
+import unittest
+
+from src.common import utils
+
+
+class TestCodecs(unittest.TestCase):
+    """Test cases for message encoding"""
+
+    post = {
+        "id": 1,
+        "title": "It's a title",
+        "content": "Blåbærsyltetøy, \"quoted\" and 'single quoted'",
+        "user_id": 2,
+        "username": "user2"
+    }
+
+    def test_round_trip(self):
+        for codec in utils.CODECS.values():
+            with self.subTest(codec=codec.__name__):
+                msg = utils.encode_msg([self.post], codec)
+                self.assertEqual(msg[:1], codec.content_type)
+                self.assertEqual(utils.msg_to_dict(msg), [self.post])
+
+    def test_join_encoded_values(self):
+        for codec in utils.CODECS.values():
+            with self.subTest(codec=codec.__name__):
+                posts = codec.join_list([codec.encode(self.post)] * 2)
+                msg = codec.content_type + codec.join_map({"posts": posts, "next": codec.encode(None)})
+                self.assertEqual(utils.msg_to_dict(msg), {"posts": [self.post] * 2, "next": None})
+                self.assertEqual(utils.msg_to_dict(codec.content_type + codec.join_list([])), [])
+
+    def test_legacy_message(self):
+        msg = str({"id": 1, "username": "user1"}).encode('ascii')
+        self.assertEqual(utils.msg_to_dict(msg), {"id": 1, "username": "user1"})
+
+    def test_codec_of(self):
+        for codec in utils.CODECS.values():
+            with self.subTest(codec=codec.__name__):
+                self.assertIs(utils.codec_of(utils.encode_msg(None, codec)), codec)
+        self.assertIs(utils.codec_of(b"42"), utils.JSONCodec)
+        self.assertIs(utils.codec_of(b""), utils.JSONCodec)
+
+
+if __name__ == '__main__':
+    unittest.main()